@@ -6,10 +6,30 @@
 """
 
 import os
+import io
+import copy
 import yaml
 import argparse
+import functools
+import hashlib
+import json
+import logging
+import threading
 import pandas as pd
 import re
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from .excel_cache import read_excel_cached
+except ImportError:
+    # 作为脚本直接运行时没有父包，使用绝对导入
+    from excel_cache import read_excel_cached
+
+# 优先使用libyaml提供的C实现，未编译libyaml时回退到纯Python实现
+try:
+    from yaml import CSafeLoader as _YamlLoader, CSafeDumper as _YamlDumper
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader, SafeDumper as _YamlDumper
 
 # =====================
 # 配置参数
@@ -20,6 +40,16 @@ GRB_DATA_DIR = os.path.join(BASE_DIR, "grb_data")
 RESULTS_DIR = os.path.join(BASE_DIR, "resultsPL2")
 EXCEL_FILE = "/home/mxr/lee/fermilat-grb.xls"  # Excel数据文件
 SHEET_NAME = "GCN"  # Excel工作表名称
+MAX_WORKERS = os.cpu_count() or 1  # 批量生成配置文件时的线程数
+
+logger = logging.getLogger(__name__)
+
+# 保证多线程下Excel表格只被解析一次
+_lookup_lock = threading.Lock()
+
+# GRB名称匹配模式
+_GRB_RE = re.compile(r'grb\s*(\d{6}[a-zA-Z])', re.IGNORECASE)
+_GRB_SPACE_RE = re.compile(r'GRB\s+')
 
 
 def format_grb_name(gcn_name):
@@ -31,11 +61,16 @@ def format_grb_name(gcn_name):
     # 去除前后空格
     gcn_name = str(gcn_name).strip()
     
+    # 已经是标准格式（如GRB220617A）时直接返回，无需正则匹配
+    if (len(gcn_name) == 10 and gcn_name.startswith('GRB')
+            and gcn_name[3:9].isdecimal() and gcn_name[9].isupper()):
+        return gcn_name
+    
     # 如果名称中包含特殊字符或格式不规范，进行标准化
     # 例如：GRB 220617A -> GRB220617A, grb220617a -> GRB220617A
     
     # 使用正则表达式提取GRB后面的数字和字母部分
-    match = re.search(r'grb\s*(\d{6}[a-zA-Z])', gcn_name, re.IGNORECASE)
+    match = _GRB_RE.search(gcn_name)
     if match:
         # 提取数字和字母部分，转换为标准格式
         grb_suffix = match.group(1).upper()
@@ -45,14 +80,38 @@ def format_grb_name(gcn_name):
     # 如果已经是标准格式，直接返回（去除多余空格）
     if gcn_name.upper().startswith('GRB'):
         # 去除GRB和后续内容之间的空格
-        formatted_name = re.sub(r'GRB\s+', 'GRB', gcn_name.upper())
+        formatted_name = _GRB_SPACE_RE.sub('GRB', gcn_name.upper())
         return formatted_name
     
     # 如果格式无法识别，返回原名称
-    print(f"警告: 无法识别的GRB名称格式: {gcn_name}")
+    logger.warning("警告: 无法识别的GRB名称格式: %s", gcn_name)
     return gcn_name
 
 
+@functools.lru_cache(maxsize=4)
+def _load_grb_lookup(excel_file, sheet_name, mtime):
+    """读取Excel表格并建立 标准化GRB名称 -> 行数据 的查找字典
+    
+    结果按(文件路径, 工作表, 修改时间)缓存，批量处理时表格只解析一次；
+    Excel文件被修改后会自动重新读取。
+    """
+    df = read_excel_cached(excel_file, sheet_name)
+    names = df['gcn_name'].astype(str).str.strip()
+    formatted = names.map(format_grb_name)
+    
+    lookup = {}
+    for name, record in zip(formatted, df.to_dict('records')):
+        # 与逐行查找保持一致：重名时以表格中第一条为准
+        lookup.setdefault(name, record)
+    return lookup
+
+
+def _get_grb_lookup(excel_file, sheet_name):
+    """获取GRB查找字典（线程安全，命中缓存时不重新读取表格）"""
+    with _lookup_lock:
+        return _load_grb_lookup(excel_file, sheet_name, os.path.getmtime(excel_file))
+
+
 def parse_grb_info(grb_name, results_dir=None, excel_file=None, sheet_name=None, outtime=70):
     """从Excel表格中解析GRB信息
     
@@ -76,21 +135,14 @@ def parse_grb_info(grb_name, results_dir=None, excel_file=None, sheet_name=None,
         raise FileNotFoundError(f"Excel文件不存在: {excel_file}")
     
     try:
-        # 读取Excel表格
-        df = pd.read_excel(excel_file, sheet_name=sheet_name)
+        # 读取Excel表格（已缓存）
+        lookup = _get_grb_lookup(excel_file, sheet_name)
         
         # 格式化输入的GRB名称
         formatted_grb_name = format_grb_name(grb_name)
         
         # 在表格中查找匹配的GRB
-        grb_row = None
-        for idx, row in df.iterrows():
-            original_gcn_name = str(row['gcn_name']).strip()
-            formatted_gcn_name = format_grb_name(original_gcn_name)
-            
-            if formatted_gcn_name == formatted_grb_name:
-                grb_row = row
-                break
+        grb_row = lookup.get(formatted_grb_name)
         
         if grb_row is None:
             raise ValueError(f"在Excel表格中未找到GRB: {grb_name} (格式化为: {formatted_grb_name})")
@@ -138,7 +190,43 @@ def parse_grb_info_from_module(grb_name, results_dir=None):
     return parse_grb_info(grb_name)
 
 
-def create_config(grb_name, grb_params, output_dir=None, template_config=None, grb_data_dir=None):
+def load_template(template_config=None):
+    """读取模板配置文件
+    
+    参数:
+        template_config (str, optional): 模板配置文件路径，默认为TEMPLATE_CONFIG
+        
+    返回:
+        dict: 解析后的模板配置
+    """
+    if template_config is None:
+        template_config = TEMPLATE_CONFIG
+    
+    with open(template_config, 'r') as f:
+        return yaml.load(f, Loader=_YamlLoader)
+
+
+def _config_digest(template_dict, grb_name, grb_params, grb_data_dir):
+    """计算生成配置文件所用全部输入的摘要，用于判断config.yaml是否需要重新生成"""
+    payload = json.dumps([template_dict, grb_name, grb_params, grb_data_dir],
+                         sort_keys=True, default=str)
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _read_config_digest(config_path):
+    """读取已有config.yaml首行记录的摘要，文件不存在或没有摘要时返回None"""
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            first_line = f.readline()
+    except OSError:
+        return None
+    if first_line.startswith('# hash: '):
+        return first_line[len('# hash: '):].strip()
+    return None
+
+
+def create_config(grb_name, grb_params, output_dir=None, template_config=None, grb_data_dir=None,
+                  template_dict=None, force=False):
     """为指定GRB创建配置文件
     
     参数:
@@ -147,30 +235,43 @@ def create_config(grb_name, grb_params, output_dir=None, template_config=None, g
         output_dir (str, optional): 输出目录，默认为RESULTS_DIR/grb_name
         template_config (str, optional): 模板配置文件路径，默认为TEMPLATE_CONFIG
         grb_data_dir (str, optional): GRB数据目录，默认为GRB_DATA_DIR
+        template_dict (dict, optional): 已解析的模板配置（见load_template），
+            提供时不再读取template_config；函数内部会复制一份，不会修改传入的字典
+        force (bool, optional): 为True时即使已有的配置文件是最新的也重新生成
         
     返回:
         str: 生成的配置文件路径
     """
     # 设置默认值
-    if template_config is None:
-        template_config = TEMPLATE_CONFIG
     if grb_data_dir is None:
         grb_data_dir = GRB_DATA_DIR
     if output_dir is None:
-        output_dir = os.path.join(RESULTS_DIR, grb_name)
+        output_dir = f"{RESULTS_DIR}/{grb_name}"
+    
+    config_path = f"{output_dir}/config.yaml"
     
     # 读取模板配置
-    with open(template_config, 'r') as f:
-        config = yaml.safe_load(f)
+    if template_dict is None:
+        template_dict = load_template(template_config)
+    
+    # 模板和GRB参数都未变化时，已有的配置文件就是最新的，无需重新生成
+    digest = _config_digest(template_dict, grb_name, grb_params, grb_data_dir)
+    if not force and _read_config_digest(config_path) == digest:
+        logger.debug("配置文件已是最新，跳过: %s", config_path)
+        return config_path
+    
+    config = copy.deepcopy(template_dict)
     
     # 清除模板中的sources数据
     if 'model' in config and 'sources' in config['model']:
         config['model']['sources'] = []
-        print("已清除配置模板中的sources数据")
+        logger.debug("已清除配置模板中的sources数据")
     
     # 更新数据文件路径
-    config['data']['evfile'] = os.path.join(grb_data_dir, grb_name, "ft1.fits")
-    config['data']['scfile'] = os.path.join(grb_data_dir, grb_name, "ft2.fits")
+    # 路径均由内部拼接（仅在Linux下运行），直接用f-string代替os.path.join
+    grb_data_path = f"{grb_data_dir}/{grb_name}"
+    config['data']['evfile'] = f"{grb_data_path}/ft1.fits"
+    config['data']['scfile'] = f"{grb_data_path}/ft2.fits"
     
     # 更新选择参数
     config['selection']['ra'] = grb_params['ra']
@@ -201,22 +302,67 @@ def create_config(grb_name, grb_params, output_dir=None, template_config=None, g
     
     # 保存新配置文件
     os.makedirs(output_dir, exist_ok=True)
-    config_path = os.path.join(output_dir, "config.yaml")
     
-    with open(config_path, 'w') as f:
-        yaml.dump(config, f, sort_keys=False)
+    # 先在内存中生成完整内容，再一次性写入临时文件并原子替换，
+    # 避免中断时留下写了一半的config.yaml；首行记录输入摘要
+    buf = io.StringIO()
+    buf.write(f"# hash: {digest}\n")
+    yaml.dump(config, buf, Dumper=_YamlDumper, sort_keys=False,
+              default_flow_style=False, width=1000, allow_unicode=True)
+    tmp_path = config_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(buf.getvalue().encode('utf-8'))
+    os.replace(tmp_path, config_path)
     
-    print(f"配置文件已创建: {config_path}")
+    logger.debug("配置文件已创建: %s", config_path)
     return config_path
 
 
-def process_all_grbs(results_dir=None, template_config=None, grb_data_dir=None):
+def _process_one(grb_name, results_dir, template_config, grb_data_dir, template_dict, force=False):
+    """为单个GRB生成配置文件（线程池任务）
+    
+    返回:
+        tuple: (GRB名称, 待打印的信息列表, 错误信息，成功时为None)
+    """
+    lines = [f"\n处理 {grb_name}..."]
+    results_subdir = f"{results_dir}/{grb_name}"
+    try:
+        # 解析GRB信息
+        grb_params = parse_grb_info(grb_name, results_dir)
+        lines.append(f"  成功解析GRB信息: {grb_name}")
+        lines.append(f"  RA: {grb_params['ra']}")
+        lines.append(f"  DEC: {grb_params['dec']}")
+        lines.append(f"  时间范围: {grb_params['tmin']} - {grb_params['tmax']}")
+        
+        # 创建配置文件
+        config_path = create_config(
+            grb_name, 
+            grb_params, 
+            results_subdir, 
+            template_config, 
+            grb_data_dir,
+            template_dict=template_dict,
+            force=force
+        )
+        
+        lines.append(f"  配置文件生成成功: {config_path}")
+        return grb_name, lines, None
+        
+    except Exception as e:
+        lines.append(f"  错误: {str(e)}")
+        return grb_name, lines, str(e)
+
+
+def process_all_grbs(results_dir=None, template_config=None, grb_data_dir=None, max_workers=MAX_WORKERS,
+                     force=False):
     """处理所有GRB目录，为每个GRB生成配置文件
     
     参数:
         results_dir (str, optional): 结果目录路径，默认为全局RESULTS_DIR
         template_config (str, optional): 模板配置文件路径，默认为TEMPLATE_CONFIG
         grb_data_dir (str, optional): GRB数据目录，默认为GRB_DATA_DIR
+        max_workers (int, optional): 并发线程数，默认为MAX_WORKERS
+        force (bool, optional): 为True时重新生成所有配置文件，不跳过已是最新的
         
     返回:
         tuple: (成功数量, 失败数量, 失败列表)
@@ -229,53 +375,49 @@ def process_all_grbs(results_dir=None, template_config=None, grb_data_dir=None):
     if grb_data_dir is None:
         grb_data_dir = GRB_DATA_DIR
     
-    # 获取所有GRB目录
-    grb_dirs = []
-    for item in os.listdir(results_dir):
-        item_path = os.path.join(results_dir, item)
-        if os.path.isdir(item_path) and item.lower().startswith('grb'):
-            grb_dirs.append(item)
-    
-    print(f"找到 {len(grb_dirs)} 个GRB目录")
-    
-    # 处理每个GRB
     success_count = 0
     failed_count = 0
     failed_grbs = []
     
-    for grb_name in sorted(grb_dirs):
-        try:
-            print(f"\n处理 {grb_name}...")
-            # 解析GRB信息
-            grb_params = parse_grb_info(grb_name, results_dir)
-            print(f"  成功解析GRB信息: {grb_name}")
-            print(f"  RA: {grb_params['ra']}")
-            print(f"  DEC: {grb_params['dec']}")
-            print(f"  时间范围: {grb_params['tmin']} - {grb_params['tmax']}")
-            
-            # 创建配置文件
-            config_path = create_config(
-                grb_name, 
-                grb_params, 
-                os.path.join(results_dir, grb_name), 
-                template_config, 
-                grb_data_dir
-            )
-            
-            print(f"  配置文件生成成功: {config_path}")
-            success_count += 1
-            
-        except Exception as e:
-            print(f"  错误: {str(e)}")
-            failed_count += 1
-            failed_grbs.append((grb_name, str(e)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # 后台预先加载GRB表格，与下面的目录扫描、模板解析重叠进行；
+        # 加载失败时不在此处理，由各GRB的parse_grb_info报告具体错误
+        executor.submit(_get_grb_lookup, EXCEL_FILE, SHEET_NAME)
+        
+        # 获取所有GRB目录（scandir直接复用目录项中的类型信息，无需逐项stat）
+        with os.scandir(results_dir) as it:
+            grb_dirs = [entry.name for entry in it
+                        if entry.name[:3].lower() == 'grb' and entry.is_dir()]
+        
+        logger.info("找到 %d 个GRB目录", len(grb_dirs))
+        
+        # 模板对所有GRB相同，只解析一次
+        template_dict = load_template(template_config)
+        
+        # 多线程处理每个GRB
+        futures = [
+            executor.submit(_process_one, grb_name, results_dir, template_config, grb_data_dir, template_dict,
+                            force)
+            for grb_name in sorted(grb_dirs)
+        ]
+        
+        # 按提交顺序（GRB名称排序）取结果，日志顺序与运行快慢无关
+        for future in futures:
+            grb_name, lines, error = future.result()
+            # 每个GRB的信息作为一条日志输出，避免多线程输出交错
+            if error is None:
+                logger.info("\n".join(lines))
+                success_count += 1
+            else:
+                logger.error("\n".join(lines))
+                failed_count += 1
+                failed_grbs.append((grb_name, error))
     
     # 打印汇总信息
-    print(f"\n处理完成: 成功 {success_count} 个, 失败 {failed_count} 个")
+    logger.info("\n处理完成: 成功 %d 个, 失败 %d 个", success_count, failed_count)
     if failed_count > 0:
-        print("失败的GRB列表:")
-        for grb_name, error in failed_grbs:
-            print(f"  {grb_name}: {error}")
+        logger.warning("失败的GRB列表:\n%s",
+                       "\n".join(f"  {grb_name}: {error}" for grb_name, error in failed_grbs))
     
     return success_count, failed_count, failed_grbs
 
@@ -289,16 +431,24 @@ def main():
     parser.add_argument('--template', help='模板配置文件路径，默认为全局TEMPLATE_CONFIG')
     parser.add_argument('--data-dir', help='GRB数据目录，默认为全局GRB_DATA_DIR')
     parser.add_argument('--output-dir', help='输出目录，默认为RESULTS_DIR/grb_name')
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS,
+                        help=f'处理所有GRB时的并发线程数（默认：{MAX_WORKERS}）')
+    parser.add_argument('--force', action='store_true', help='强制重新生成配置文件，即使已是最新')
     
     args = parser.parse_args()
     
+    # 命令行运行时输出INFO级别信息，与原先的打印输出保持一致
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    
     # 处理所有GRB
     if args.all or args.grb_name is None:
-        print("开始处理所有GRB目录...")
+        logger.info("开始处理所有GRB目录...")
         success_count, failed_count, _ = process_all_grbs(
             args.results_dir,
             args.template,
-            args.data_dir
+            args.data_dir,
+            args.workers,
+            args.force
         )
         
         if failed_count > 0:
@@ -308,10 +458,9 @@ def main():
     # 处理单个GRB
     try:
         grb_params = parse_grb_info(args.grb_name, args.results_dir)
-        print(f"成功解析GRB信息: {args.grb_name}")
-        print(f"  RA: {grb_params['ra']}")
-        print(f"  DEC: {grb_params['dec']}")
-        print(f"  时间范围: {grb_params['tmin']} - {grb_params['tmax']}")
+        logger.info("成功解析GRB信息: %s\n  RA: %s\n  DEC: %s\n  时间范围: %s - %s",
+                    args.grb_name, grb_params['ra'], grb_params['dec'],
+                    grb_params['tmin'], grb_params['tmax'])
         
         # 创建配置文件
         config_path = create_config(
@@ -319,13 +468,14 @@ def main():
             grb_params, 
             args.output_dir, 
             args.template, 
-            args.data_dir
+            args.data_dir,
+            force=args.force
         )
         
-        print(f"配置文件生成成功: {config_path}")
+        logger.info("配置文件生成成功: %s", config_path)
         
     except Exception as e:
-        print(f"错误: {str(e)}")
+        logger.error("错误: %s", e)
         return 1
     
     return 0
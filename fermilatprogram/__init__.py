@@ -17,6 +17,7 @@ Fermi-LAT GRB数据分析工具包
 - Generate_gconfig: 配置文件生成模块
 - download: 数据下载模块
 - cleandir: 结果目录清理模块
+- excel_cache: Excel表格读取与Parquet缓存模块
 """
 
 __version__ = "1.0.0"
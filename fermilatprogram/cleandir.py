@@ -3,6 +3,8 @@ import shutil
 import argparse
 import datetime
 import fnmatch
+import logging
+import re
 import threading
 import time
 import uuid
@@ -11,9 +13,61 @@ import uuid
 BASE_DIR = "/home/mxr/lee/data/fermilat"
 RESULTS_DIR = os.path.join(BASE_DIR, "resultsPL2")
 
+logger = logging.getLogger(__name__)
+
+# 旧版本清理时遗留的GRB基础数据临时文件：.{GRB}.txt.<8位十六进制>
+_STALE_INFO_RE = re.compile(r'^\.(.+)\.txt\.[0-9a-f]{8}$')
+
 # 线程锁，用于同步备份操作
 backup_lock = threading.Lock()
 
+def _snapshot_tree(src_dir, dst_dir, keep_file=None):
+    """为目录创建快照：清理时会被删除的文件以硬链接方式备份，不复制文件内容
+    
+    清理后仍留在原目录的文件（keep_file(path)为True）之后可能被原地改写，
+    与备份共用inode会连带改变备份，因此这些文件完整复制。
+    清理时只删除原目录中的链接，备份中的链接仍指向原数据。
+    文件系统不支持硬链接（或跨文件系统）时回退为完整复制。
+    dst_dir已存在时抛出FileExistsError，不会删除或改动已有目录。
+    """
+    def link_or_copy(src, dst):
+        if keep_file is not None and keep_file(src):
+            return shutil.copy2(src, dst)
+        os.link(src, dst)
+        return dst
+    
+    try:
+        shutil.copytree(src_dir, dst_dir, copy_function=link_or_copy)
+    except FileExistsError:
+        # copytree第一步创建dst_dir，已存在时抛出FileExistsError：该目录不是本次调用创建的，保持原样
+        raise
+    except (shutil.Error, OSError) as e:
+        # 其余错误发生时dst_dir（若存在）是本次调用创建的，删除不完整的备份后重新完整复制
+        logger.info("硬链接备份失败，改为完整复制: %s", e)
+        shutil.rmtree(dst_dir, ignore_errors=True)
+        shutil.copytree(src_dir, dst_dir)
+
+def _restore_stale_info_files(results_dir):
+    """把旧版本清理时临时改名的.{GRB}.txt.<hex>放回{GRB}/{GRB}.txt
+    
+    旧版本清理时先把GRB基础数据文件改名到结果目录顶层，删除子目录后再改回；
+    两次改名之间进程被杀死时文件会留在顶层，不放回就会被当作普通文件删除。
+    原位置已有文件时保持不动。
+    """
+    stale = []
+    with os.scandir(results_dir) as it:
+        for entry in it:
+            match = _STALE_INFO_RE.match(entry.name)
+            if match and entry.is_file():
+                stale.append((entry.path, match.group(1)))
+    for stale_path, grb_name in stale:
+        grb_info_file = os.path.join(results_dir, grb_name, f"{grb_name}.txt")
+        if os.path.exists(grb_info_file):
+            continue
+        os.makedirs(os.path.dirname(grb_info_file), exist_ok=True)
+        os.rename(stale_path, grb_info_file)
+        logger.info("恢复GRB基础数据文件: %s", grb_info_file)
+
 def clean_results_directory(backup=False, target_dir=None, keep_patterns=None):
     """清理结果目录，只保留指定模式的文件
     
@@ -25,9 +79,25 @@ def clean_results_directory(backup=False, target_dir=None, keep_patterns=None):
     # 设置默认保留模式
     if keep_patterns is None:
         keep_patterns = ['GRB*.txt']
+    # 将所有保留模式合并编译为一个正则，每个文件只需匹配一次
+    if keep_patterns:
+        keep_re = re.compile('|'.join(f"(?:{fnmatch.translate(p)})" for p in keep_patterns))
+    else:
+        keep_re = None
     # 如果指定了目标目录，则使用指定的目录
     results_dir = target_dir if target_dir else RESULTS_DIR
-    print(f"正在清理结果目录: {results_dir}...")
+    logger.info("正在清理结果目录: %s...", results_dir)
+    
+    def _is_kept(path):
+        """清理后仍保留在结果目录中的文件：匹配保留模式的顶层文件和各GRB目录下的{GRB}.txt"""
+        parts = os.path.relpath(path, results_dir).split(os.sep)
+        if len(parts) == 1:
+            return keep_re is not None and keep_re.match(parts[0]) is not None
+        return len(parts) == 2 and parts[1] == f"{parts[0]}.txt"
+    
+    # 先放回旧版本遗留的GRB基础数据文件，使备份和清理都看到它们原本的位置
+    if os.path.isdir(results_dir):
+        _restore_stale_info_files(results_dir)
     
     # 如果需要备份，创建备份（线程安全）
     if backup:
@@ -43,65 +113,64 @@ def clean_results_directory(backup=False, target_dir=None, keep_patterns=None):
                               if d.startswith(f"{os.path.basename(results_dir)}_backup_{timestamp}")]
             
             if existing_backups:
-                print(f"发现已存在的备份: {existing_backups[0]}，跳过备份创建")
+                logger.info("发现已存在的备份: %s，跳过备份创建", existing_backups[0])
             elif os.path.exists(results_dir):
                 try:
-                    print(f"创建备份: {backup_dir}")
-                    shutil.copytree(results_dir, backup_dir)
-                    print(f"备份创建成功: {backup_dir}")
+                    logger.info("创建备份: %s", backup_dir)
+                    _snapshot_tree(results_dir, backup_dir, keep_file=_is_kept)
+                    logger.info("备份创建成功: %s", backup_dir)
                 except FileExistsError:
-                    print(f"备份目录已存在，跳过: {backup_dir}")
+                    logger.info("备份目录已存在，跳过: %s", backup_dir)
                 except Exception as e:
-                    print(f"创建备份失败: {str(e)}")
+                    logger.error("创建备份失败: %s", e)
     
     if not os.path.exists(results_dir):
         os.makedirs(results_dir, exist_ok=True)
-        print(f"创建结果目录: {results_dir}")
+        logger.info("创建结果目录: %s", results_dir)
         return
     
-    # 遍历结果目录中的所有子目录和文件
-    for item in os.listdir(results_dir):
-        item_path = os.path.join(results_dir, item)
+    # 遍历结果目录中的所有子目录和文件（先取出目录项，避免边遍历边删除）
+    with os.scandir(results_dir) as it:
+        entries = list(it)
+    
+    deleted_dirs = []
+    deleted_files = []
+    kept_files = []
+    
+    for entry in entries:
+        item = entry.name
+        item_path = entry.path
         
-        if os.path.isdir(item_path):
+        if entry.is_dir():
             # 处理子目录（如results/GRB250313A/）
-            grb_name = os.path.basename(item_path)
-            grb_info_file = os.path.join(item_path, f"{grb_name}.txt")
+            grb_name = item
+            grb_info_name = f"{grb_name}.txt"
             
-            # 备份GRB基础数据文件
-            grb_info_backup = None
-            if os.path.exists(grb_info_file):
-                with open(grb_info_file, 'r') as f:
-                    grb_info_backup = f.read()
-                print(f"备份GRB基础数据文件: {grb_info_file}")
-            
-            # 删除整个子目录
-            shutil.rmtree(item_path)
-            print(f"删除目录: {item_path}")
-            
-            # 重新创建目录并恢复GRB基础数据文件
-            os.makedirs(item_path, exist_ok=True)
-            if grb_info_backup:
-                with open(grb_info_file, 'w') as f:
-                    f.write(grb_info_backup)
-                print(f"恢复GRB基础数据文件: {grb_info_file}")
+            # 删除子目录中除GRB基础数据文件外的全部内容；基础数据文件按名称跳过，
+            # 始终留在原处，进程在清理中途被杀死也不会丢失
+            with os.scandir(item_path) as sub_it:
+                sub_entries = list(sub_it)
+            for sub_entry in sub_entries:
+                if sub_entry.name == grb_info_name and sub_entry.is_file():
+                    logger.debug("保留GRB基础数据文件: %s", sub_entry.path)
+                elif sub_entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(sub_entry.path)
+                else:
+                    os.remove(sub_entry.path)
+            deleted_dirs.append(item_path)
         
-        elif os.path.isfile(item_path):
-            # 检查文件是否匹配任何保留模式
-            should_keep = False
-            for pattern in keep_patterns:
-                if fnmatch.fnmatch(item, pattern):
-                    should_keep = True
-                    break
-            
-            # 根据匹配结果决定是否保留文件
-            if should_keep:
-                print(f"保留文件: {item_path}")
+        elif entry.is_file():
+            # 根据是否匹配任何保留模式决定是否保留文件
+            if keep_re is not None and keep_re.match(item):
+                kept_files.append(item_path)
             else:
                 os.remove(item_path)
-                print(f"删除文件: {item_path}")
+                deleted_files.append(item_path)
     
-    print("结果目录清理完成")
+    logger.debug("删除的目录: %s\n删除的文件: %s\n保留的文件: %s",
+                 deleted_dirs, deleted_files, kept_files)
+    logger.info("结果目录清理完成: 删除 %d 个目录, %d 个文件, 保留 %d 个文件",
+                len(deleted_dirs), len(deleted_files), len(kept_files))
 
 def main():
     """主函数，用于命令行调用"""
@@ -113,6 +182,8 @@ def main():
     
     args = parser.parse_args()
     
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    
     clean_results_directory(
         backup=args.backup,
         target_dir=args.target_dir,
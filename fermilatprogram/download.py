@@ -1,12 +1,20 @@
 import os
 import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import re
 import pandas as pd
 from bs4 import BeautifulSoup
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import threading
-from datetime import datetime
+import queue
+import atexit
+try:
+    from .excel_cache import read_excel_cached
+except ImportError:
+    # 作为脚本直接运行时没有父包，使用绝对导入
+    from excel_cache import read_excel_cached
 
 # 需要修改save_dir
 # excel路径
@@ -16,16 +24,98 @@ from datetime import datetime
 # excel_file 需要修改
 
 # 配置参数
-MAX_WORKERS = 3  # 最大并发线程数，避免对服务器造成过大压力
-thread_lock = threading.Lock()  # 线程锁，用于安全打印
+MAX_QUERIES = 3  # 同时向查询CGI提交/轮询的GRB数，避免对服务器造成过大压力
+MAX_DOWNLOADS = 16  # 全局同时进行的FITS文件下载数
+MAX_WORKERS = MAX_DOWNLOADS  # GRB级并发线程数；查询和下载阶段分别由下面的信号量限流
+_print_queue = queue.Queue()  # 待打印的消息，由单独的打印线程依次输出
+_printer = None  # 打印线程，首次调用thread_safe_print时启动
+_printer_lock = threading.Lock()
+_atexit_registered = False
+_tls = threading.local()  # 每个线程独立的HTTP会话
+_query_slots = threading.BoundedSemaphore(MAX_QUERIES)  # 查询阶段名额
+_download_slots = threading.BoundedSemaphore(MAX_DOWNLOADS)  # 下载阶段名额
+RESULT_POLL_DELAYS = (2, 3, 5, 8, 13, 21, 34, 55)  # 轮询查询结果页面的间隔（秒）
+QUERY_INTERVAL = 15  # 所有线程两次提交查询之间的最小间隔（秒）
+_rate_lock = threading.Lock()
+_next_query_time = 0.0  # 下一次允许提交查询的时刻（time.monotonic）
+DOWNLOAD_CHUNK_SIZE = 1 << 20  # 下载时每次读取/写入的字节数（1 MiB）
+DROP_CACHE_WINDOW = 64 << 20  # 每写满该字节数落盘一次并释放对应页缓存（64 MiB）
+
+# 预编译的正则表达式
+_SAFE_NAME_RE = re.compile(r'[^a-zA-Z0-9_.-]')  # 文件名中的非法字符
+_RESULTS_URL_RE = re.compile(r'https://fermi\.gsfc\.nasa\.gov/cgi-bin/ssc/LAT/QueryResults\.cgi\?id=L[\dA-F]+')  # 查询结果页面
+_WGET_RE = re.compile(r'wget\s+(https://fermi\.gsfc\.nasa\.gov/FTP/fermi/data/lat/queries/\S+\.fits)')
+
+def _get_session():
+    """获取当前线程的requests.Session，同一线程的所有请求复用连接（keep-alive）"""
+    session = getattr(_tls, 'session', None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=MAX_WORKERS,
+            pool_maxsize=MAX_WORKERS * 4,
+            max_retries=Retry(total=3, backoff_factor=1, status_forcelist=[502, 503, 504])
+        )
+        session.mount('https://', adapter)
+        session.headers['Connection'] = 'keep-alive'
+        _tls.session = session
+    return session
+
+def _drain_print_queue():
+    """打印线程：依次取出消息并输出，收到None时退出"""
+    while True:
+        item = _print_queue.get()
+        if item is None:
+            break
+        created, message = item
+        print(f"[{time.strftime('%H:%M:%S', time.localtime(created))}] {message}")
+
+def _ensure_printer():
+    """首次打印时才启动打印线程，仅导入本模块的程序不会多出后台线程（调用方需持有_printer_lock）"""
+    global _printer, _atexit_registered
+    if _printer is None:
+        _printer = threading.Thread(target=_drain_print_queue, name='printer', daemon=True)
+        _printer.start()
+        if not _atexit_registered:
+            # 程序退出前输出队列中剩余的消息
+            atexit.register(_stop_printer)
+            _atexit_registered = True
+
+def _stop_printer():
+    """输出队列中剩余的消息并停止打印线程（之后再打印时会重新启动）"""
+    global _printer
+    with _printer_lock:
+        if _printer is not None:
+            _print_queue.put(None)
+            _printer.join()
+            _printer = None
+
+def _wait_for_query_turn():
+    """全局限速：预约下一个提交时刻并等待，保证各线程提交查询的间隔不小于QUERY_INTERVAL"""
+    global _next_query_time
+    with _rate_lock:
+        now = time.monotonic()
+        wait = max(0.0, _next_query_time - now)
+        _next_query_time = max(now, _next_query_time) + QUERY_INTERVAL
+    # 在锁外等待，其他线程可以同时预约之后的时刻
+    if wait:
+        time.sleep(wait)
 
 def thread_safe_print(message):
-    """线程安全的打印函数"""
-    with thread_lock:
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        print(f"[{timestamp}] {message}")
+    """线程安全的打印函数：只把消息放入队列，不阻塞调用线程"""
+    # 持锁入队，保证消息不会排在停止打印线程的None之后而丢失
+    with _printer_lock:
+        _ensure_printer()
+        _print_queue.put((time.time(), message))
+
+def _drop_page_cache(f, offset, length):
+    """把文件[offset, offset+length)区间写回磁盘后丢弃其页缓存"""
+    f.flush()
+    os.fdatasync(f.fileno())
+    os.posix_fadvise(f.fileno(), offset, length, os.POSIX_FADV_DONTNEED)
 
-def download_file(url, save_dir="/home/mxr/lee/data/fermilat", filename=None, headers=None, retries=3):
+def download_file(url, save_dir="/home/mxr/lee/data/fermilat", filename=None, headers=None, retries=3,
+                  session=None):
     """
     通用文件下载函数
     :param url: 文件下载地址
@@ -33,36 +123,74 @@ def download_file(url, save_dir="/home/mxr/lee/data/fermilat", filename=None, he
     :param filename: 自定义文件名（默认从URL提取）
     :param headers: 请求头设置
     :param retries: 失败重试次数
+    :param session: 复用的requests.Session（默认使用当前线程的会话）
     """
+    session = session or _get_session()
+
     # 创建保存目录
     os.makedirs(save_dir, exist_ok=True)
     
     # 生成安全文件名
     filename = filename or os.path.basename(url.split("?")[0])
-    filename = re.sub(r'[^a-zA-Z0-9_.-]', '_', filename)  # 过滤非法字符
+    filename = _SAFE_NAME_RE.sub('_', filename)  # 过滤非法字符
     
     filepath = os.path.join(save_dir, filename)
     
     # 重试机制
     for attempt in range(retries):
         try:
-            response = requests.get(url, headers=headers, stream=True, timeout=30)
-            response.raise_for_status()
+            # 全局限制同时进行的下载数
+            with _download_slots:
+                # 本地已有文件时先用HEAD获取远程文件大小：大小一致则跳过，文件不完整则断点续传
+                resume_from = os.path.getsize(filepath) if os.path.exists(filepath) else 0
+                request_headers = headers
+                if resume_from:
+                    try:
+                        head = session.head(url, headers=headers, timeout=30, allow_redirects=True)
+                        head.raise_for_status()
+                        remote_size = int(head.headers.get('content-length', 0))
+                    except requests.RequestException:
+                        remote_size = 0  # 无法获取远程大小时重新完整下载
+                    if remote_size and resume_from == remote_size:
+                        thread_safe_print(f"文件已完整存在，跳过下载: {os.path.abspath(filepath)}")
+                        return True
+                    if resume_from < remote_size:
+                        request_headers = {**(headers or {}), 'Range': f'bytes={resume_from}-'}
+                    else:
+                        resume_from = 0
+                
+                response = session.get(url, headers=request_headers, stream=True, timeout=30)
+                response.raise_for_status()
+                # 服务器不支持Range时返回200和完整内容，此时从头写入
+                if response.status_code != 206:
+                    resume_from = 0
             
-            # 显示下载进度
-            total_size = int(response.headers.get('content-length', 0))
-            downloaded = 0
+                # 显示下载进度（每完成约10%打印一次）
+                total_size = resume_from + int(response.headers.get('content-length', 0))
+                progress_step = max(total_size // 10, 1)
+                downloaded = resume_from
+                next_progress = (downloaded // progress_step + 1) * progress_step
             
-            with open(filepath, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                        if total_size > 0:
-                            progress = downloaded / total_size * 100
-                            # 使用线程安全打印，避免进度条混乱
-                            if downloaded == total_size or downloaded % (total_size // 10) == 0:
+                # FITS文件下载后不会马上再读，按窗口落盘后提示内核不必保留其页缓存
+                # （DONTNEED只丢弃干净页，必须先fdatasync，否则脏页不会被释放）
+                drop_cache = hasattr(os, 'posix_fadvise')
+                synced = resume_from
+                with open(filepath, 'ab' if resume_from else 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        if chunk:
+                            f.write(chunk)
+                            downloaded += len(chunk)
+                            if drop_cache and downloaded - synced >= DROP_CACHE_WINDOW:
+                                _drop_page_cache(f, synced, downloaded - synced)
+                                synced = downloaded
+                            if total_size > 0 and downloaded >= next_progress:
+                                progress = downloaded / total_size * 100
+                                # 使用线程安全打印，避免进度条混乱
                                 thread_safe_print(f"下载 {filename}: {progress:.1f}%")
+                                next_progress = (downloaded // progress_step + 1) * progress_step
+                    
+                    if drop_cache and downloaded > synced:
+                        _drop_page_cache(f, synced, downloaded - synced)
             
             thread_safe_print(f"文件已保存到: {os.path.abspath(filepath)}")
             return True
@@ -101,43 +229,47 @@ def query_and_download_fermi_data(trigger_met, T0, T1, ra, dec, emin='100', emax
         'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
     }
     
+    session = _get_session()
+    
     try:
-        # 提交查询请求
-        response = requests.post(url, data=payload, headers=headers)
-        response.raise_for_status()
-        
-        # 提取结果页面URL
-        match = re.search(
-            r'https://fermi\.gsfc\.nasa\.gov/cgi-bin/ssc/LAT/QueryResults\.cgi\?id=L[\dA-F]+', 
-            response.text
-        )
-        if not match:
-            raise ValueError("未找到查询结果链接")
-        
-        download_url = match.group(0)
-        thread_safe_print(f"结果页面: {download_url}")
+        # 查询阶段单独限流，等待服务器处理期间不占用下载名额
+        with _query_slots:
+            # 提交查询请求（全局限速，避免突发提交导致服务器超时）
+            _wait_for_query_turn()
+            response = session.post(url, data=payload, headers=headers)
+            response.raise_for_status()
         
-        # 等待数据处理完成
-        thread_safe_print("等待服务器处理数据...")
-        time.sleep(10)
+            # 提取结果页面URL
+            match = _RESULTS_URL_RE.search(response.text)
+            if not match:
+                raise ValueError("未找到查询结果链接")
         
-        # 获取结果页面
-        result_response = requests.get(download_url, headers=headers)
-        result_response.raise_for_status()
+            download_url = match.group(0)
+            thread_safe_print(f"结果页面: {download_url}")
         
-        # 解析下载链接
-        wget_pattern = r'wget\s+(https://fermi\.gsfc\.nasa\.gov/FTP/fermi/data/lat/queries/\S+\.fits)'
-        wget_links = re.findall(wget_pattern, result_response.text)
+            # 轮询结果页面，直到服务器处理完成、页面中出现下载链接
+            thread_safe_print("等待服务器处理数据...")
+            wget_links = []
+            for delay in RESULT_POLL_DELAYS:
+                time.sleep(delay)
+                result_response = session.get(download_url, headers=headers)
+                result_response.raise_for_status()
+                wget_links = _WGET_RE.findall(result_response.text)
+                if wget_links:
+                    break
         
         if not wget_links:
             raise ValueError("未找到有效的下载链接")
         
-        # 下载所有文件
-        success_count = 0
+        # 并行下载所有文件（通常为事例文件和航天器文件），每个下载线程使用自己的会话
         for file_url in wget_links:
             thread_safe_print(f"正在下载文件: {os.path.basename(file_url)}")
-            if download_file(file_url, save_dir=save_dir, headers=headers):
-                success_count += 1
+        with ThreadPoolExecutor(max_workers=min(4, len(wget_links))) as file_executor:
+            futures = [
+                file_executor.submit(download_file, file_url, save_dir=save_dir, headers=headers)
+                for file_url in wget_links
+            ]
+            success_count = sum(1 for future in as_completed(futures) if future.result())
         
         thread_safe_print(f"下载完成: {success_count}/{len(wget_links)} 个文件成功下载")
     
@@ -147,32 +279,54 @@ def query_and_download_fermi_data(trigger_met, T0, T1, ra, dec, emin='100', emax
     
     return success_count == len(wget_links)
 
-def process_single_grb(row_data, base_save_dir):
+def _prepare_tasks(df):
+    """
+    向量化解析并校验Excel中的所有行
+    :param df: Excel表格数据
+    :return: (任务元组列表 (gcn_name, trigger_met, ra, dec, T0, T1), 无效条目的GRB名称列表)
+    """
+    # 没有数据行时拆分坐标得不到任何列，直接返回
+    if df.empty:
+        return [], []
+    
+    gcn_names = df['gcn_name'].astype(str)
+    
+    # 解析合并的ra,dec坐标
+    ra_dec = df['ra,dec'].astype(str).str.strip()
+    valid_ra_dec = ra_dec.str.count(',') == 1
+    ra_dec_parts = ra_dec.where(valid_ra_dec, ',').str.split(',', n=1, expand=True)
+    
+    values = pd.DataFrame({
+        'gcn_name': gcn_names,
+        'trigger_met': pd.to_numeric(df['trigger_met'], errors='coerce'),
+        'ra': pd.to_numeric(ra_dec_parts[0].str.strip(), errors='coerce'),
+        'dec': pd.to_numeric(ra_dec_parts[1].str.strip(), errors='coerce'),
+        'T0': pd.to_numeric(df['T0'], errors='coerce'),
+        'T1': pd.to_numeric(df['T1'], errors='coerce'),
+    }).astype({'trigger_met': float, 'ra': float, 'dec': float, 'T0': float, 'T1': float})
+    valid = values.notna().all(axis=1)
+    
+    invalid_names = []
+    for gcn_name, ra_dec_str, ra_dec_ok in zip(gcn_names[~valid], ra_dec[~valid], valid_ra_dec[~valid]):
+        if not ra_dec_ok:
+            thread_safe_print(f"警告: {gcn_name} 的ra,dec格式不正确: '{ra_dec_str}'，跳过此条")
+        else:
+            thread_safe_print(f"警告: {gcn_name} 的参数无法转换为数值，跳过此条")
+        invalid_names.append(gcn_name)
+    
+    tasks = list(values[valid].itertuples(index=False, name=None))
+    return tasks, invalid_names
+
+def process_single_grb(task, base_save_dir):
     """
     处理单个GRB数据下载的函数（用于多线程）
-    :param row_data: 包含GRB信息的元组 (idx, row)
+    :param task: 已解析的GRB参数元组 (gcn_name, trigger_met, ra, dec, T0, T1)
     :param base_save_dir: 基础保存目录
     :return: (gcn_name, success_status)
     """
-    idx, row = row_data
+    gcn_name, trigger_met, ra, dec, T0, T1 = task
     
     try:
-        gcn_name = str(row['gcn_name'])
-        trigger_met = float(row['trigger_met'])
-        
-        # 解析合并的ra,dec坐标
-        ra_dec = str(row['ra,dec']).strip()
-        ra_dec_parts = ra_dec.split(',')
-        if len(ra_dec_parts) != 2:
-            thread_safe_print(f"警告: {gcn_name} 的ra,dec格式不正确: '{ra_dec}'，跳过此条")
-            return gcn_name, False
-            
-        ra = float(ra_dec_parts[0].strip())
-        dec = float(ra_dec_parts[1].strip())
-        
-        T0 = float(row['T0'])
-        T1 = float(row['T1'])
-        
         # 创建保存目录
         save_dir = os.path.join(base_save_dir, f"grb_data/{gcn_name}")
         
@@ -210,7 +364,7 @@ def process_excel_and_download(excel_path, base_save_dir="/home/mxr/lee/data/fer
     """
     try:
         # 读取Excel文件
-        df = pd.read_excel(excel_path, sheet_name='Sheet1')
+        df = read_excel_cached(excel_path, 'Sheet1')
         thread_safe_print(f"成功读取Excel文件，共有{len(df)}条记录")
         
         # 确保所需列存在
@@ -219,14 +373,13 @@ def process_excel_and_download(excel_path, base_save_dir="/home/mxr/lee/data/fer
         if missing_columns:
             raise ValueError(f"Excel表格缺少以下列: {', '.join(missing_columns)}")
         
-        # 准备任务数据
-        tasks = [(idx, row) for idx, row in df.iterrows()]
+        # 准备任务数据（格式不正确的条目直接记为失败，不提交给线程池）
+        tasks, failed_grbs = _prepare_tasks(df)
         
         # 使用线程池执行多线程下载
         thread_safe_print(f"开始多线程下载，使用 {max_workers} 个线程")
         
         success_count = 0
-        failed_grbs = []
         
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
             # 提交所有任务
@@ -247,7 +400,7 @@ def process_excel_and_download(excel_path, base_save_dir="/home/mxr/lee/data/fer
                 except Exception as e:
                     task = future_to_task[future]
                     thread_safe_print(f"任务执行异常: {str(e)}")
-                    failed_grbs.append(f"Task-{task[0]}")
+                    failed_grbs.append(task[0])
         
         # 输出最终统计
         thread_safe_print(f"\n=== 下载完成统计 ===")
@@ -264,6 +417,10 @@ def process_excel_and_download(excel_path, base_save_dir="/home/mxr/lee/data/fer
     except Exception as e:
         thread_safe_print(f"处理Excel文件时出错: {str(e)}")
         return False
+    
+    finally:
+        # 批量下载结束后输出剩余消息并停止打印线程
+        _stop_printer()
 
 def main():
     """主函数，支持命令行参数"""
@@ -277,8 +434,8 @@ def main():
                        default='/home/mxr/lee/data/fermilat',
                        help='输出目录（默认：/home/mxr/lee/data/fermilat）')
     parser.add_argument('--workers', '-w',
-                       type=int, default=3,
-                       help='并发线程数（默认：3）')
+                       type=int, default=MAX_WORKERS,
+                       help=f'并发线程数（默认：{MAX_WORKERS}）')
     
     args = parser.parse_args()
     
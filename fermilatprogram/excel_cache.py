@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+读取Excel工作表，并维护一份Parquet缓存（供配置生成、数据下载等模块共用）
+"""
+
+import os
+import logging
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+def read_excel_cached(excel_file, sheet_name):
+    """读取Excel工作表，并在Excel文件旁维护一份Parquet缓存
+    
+    缓存比Excel文件新时直接读取缓存，否则重新解析Excel并更新缓存。
+    未安装Parquet引擎（pyarrow/fastparquet）或缓存不可写时直接读取Excel。
+    解析Excel时优先使用calamine引擎，未安装python-calamine时使用pandas默认引擎。
+    """
+    cache_file = f"{os.path.splitext(excel_file)[0]}.{sheet_name}.parquet"
+    
+    if os.path.exists(cache_file) and os.path.getmtime(cache_file) >= os.path.getmtime(excel_file):
+        try:
+            return pd.read_parquet(cache_file)
+        except Exception as e:
+            logger.debug("读取Parquet缓存失败，改为读取Excel: %s", e)
+    
+    try:
+        df = pd.read_excel(excel_file, sheet_name=sheet_name, engine='calamine')
+    except (ImportError, ValueError):
+        df = pd.read_excel(excel_file, sheet_name=sheet_name)
+    
+    tmp_file = cache_file + '.tmp'
+    try:
+        df.to_parquet(tmp_file)
+        os.replace(tmp_file, cache_file)
+    except Exception as e:
+        logger.debug("写入Parquet缓存失败: %s", e)
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    
+    return df
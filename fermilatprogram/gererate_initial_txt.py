@@ -3,6 +3,19 @@
 import os
 import pandas as pd
 import re
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+try:
+    from .excel_cache import read_excel_cached
+except ImportError:
+    # 作为脚本直接运行时没有父包，使用绝对导入
+    from excel_cache import read_excel_cached
+
+MAX_WORKERS = 16  # 并行写入GRB信息文件的线程数
+
+# GRB名称匹配模式
+_GRB_RE = re.compile(r'grb\s*(\d{6}[a-zA-Z])', re.IGNORECASE)
+_GRB_SPACE_RE = re.compile(r'GRB\s+')
 
 def format_grb_name(gcn_name):
     """
@@ -13,11 +26,16 @@ def format_grb_name(gcn_name):
     # 去除前后空格
     gcn_name = str(gcn_name).strip()
     
+    # 已经是标准格式（如GRB220617A）时直接返回，无需正则匹配
+    if (len(gcn_name) == 10 and gcn_name.startswith('GRB')
+            and gcn_name[3:9].isdecimal() and gcn_name[9].isupper()):
+        return gcn_name
+    
     # 如果名称中包含特殊字符或格式不规范，进行标准化
     # 例如：GRB 220617A -> GRB220617A, grb220617a -> GRB220617A
     
     # 使用正则表达式提取GRB后面的数字和字母部分
-    match = re.search(r'grb\s*(\d{6}[a-zA-Z])', gcn_name, re.IGNORECASE)
+    match = _GRB_RE.search(gcn_name)
     if match:
         # 提取数字和字母部分，转换为标准格式
         grb_suffix = match.group(1).upper()
@@ -27,78 +45,112 @@ def format_grb_name(gcn_name):
     # 如果已经是标准格式，直接返回（去除多余空格）
     if gcn_name.upper().startswith('GRB'):
         # 去除GRB和后续内容之间的空格
-        formatted_name = re.sub(r'GRB\s+', 'GRB', gcn_name.upper())
+        formatted_name = _GRB_SPACE_RE.sub('GRB', gcn_name.upper())
         return formatted_name
     
     # 如果格式无法识别，返回原名称
     print(f"警告: 无法识别的GRB名称格式: {gcn_name}")
     return gcn_name
 
-def write_grb_info_to_text(excel_path, sheet_name="GCN", base_dir="/home/mxr/lee/data/fermilat/resultsPL2"):
+def _write_grb_txt(base_dir, original_gcn_name, formatted_gcn_name, trigger_met, ra, dec, pindex, T0, T1,
+                   generated_at):
+    """为单个GRB创建文件夹并写入信息文本文件（线程池任务），返回文本文件路径"""
+    # 使用格式化后的名称创建文件夹
+    folder_path = os.path.join(base_dir, formatted_gcn_name)
+    os.makedirs(folder_path, exist_ok=True)
+
+    # 创建文本文件
+    # 整个文件内容一次性写入
+    txt_path = os.path.join(folder_path, f"{formatted_gcn_name}.txt")
+    content = (
+        f"# GRB信息文件\n"
+        f"# 原始名称: {original_gcn_name}\n"
+        f"# 标准化名称: {formatted_gcn_name}\n"
+        f"# 生成时间: {generated_at}\n\n"
+        f"trigger_met: {trigger_met}\n"
+        f"ra: {ra}\n"
+        f"dec: {dec}\n"
+        f"PIndex: {pindex}\n"
+        f"T0: {T0}\n"
+        f"T1: {T1}\n"
+    )
+    with open(txt_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    return txt_path
+
+def write_grb_info_to_text(excel_path, sheet_name="GCN", base_dir="/home/mxr/lee/data/fermilat/resultsPL2",
+                           max_workers=MAX_WORKERS):
     """
     读取Excel表格，为每个GRB生成标准化的文件夹和文本信息
     :param excel_path: Excel文件路径
     :param sheet_name: 工作表名称
     :param base_dir: 基础目录路径
+    :param max_workers: 并行写入文件的线程数
     """
     # 读取Excel表格
-    df = pd.read_excel(excel_path, sheet_name=sheet_name)
+    df = read_excel_cached(excel_path, sheet_name)
     
     print(f"开始处理 {len(df)} 个GRB条目...")
     
     processed_count = 0
     skipped_count = 0
-
-    for idx, row in df.iterrows():
-        try:
-            # 获取原始GRB名称并格式化
-            original_gcn_name = str(row['gcn_name']).strip()
-            formatted_gcn_name = format_grb_name(original_gcn_name)
-            
-            # 如果名称发生了变化，显示转换信息
-            if original_gcn_name != formatted_gcn_name:
-                print(f"[格式化] {original_gcn_name} -> {formatted_gcn_name}")
-            
-            trigger_met = row['trigger_met']
-            T0 = row['T0']
-            T1 = row['T1']
-            ra_dec = str(row['ra,dec']).strip()
-            ra_dec_parts = ra_dec.split(',')
-            
-            if len(ra_dec_parts) != 2:
-                print(f"警告: {formatted_gcn_name} 的ra,dec格式不正确: '{ra_dec}'，跳过此条")
-                skipped_count += 1
-                continue
-                    
-            ra = float(ra_dec_parts[0].strip())
-            dec = float(ra_dec_parts[1].strip())
-            pindex = row.get('PIndex', 'N/A')  # 有些可能缺失
-
-            # 使用格式化后的名称创建文件夹
-            folder_path = os.path.join(base_dir, formatted_gcn_name)
-            os.makedirs(folder_path, exist_ok=True)
-
-            # 创建文本文件
-            txt_path = os.path.join(folder_path, f"{formatted_gcn_name}.txt")
-            with open(txt_path, 'w', encoding='utf-8') as f:
-                f.write(f"# GRB信息文件\n")
-                f.write(f"# 原始名称: {original_gcn_name}\n")
-                f.write(f"# 标准化名称: {formatted_gcn_name}\n")
-                f.write(f"# 生成时间: {pd.Timestamp.now()}\n\n")
-                f.write(f"trigger_met: {trigger_met}\n")
-                f.write(f"ra: {ra}\n")
-                f.write(f"dec: {dec}\n")
-                f.write(f"PIndex: {pindex}\n")
-                f.write(f"T0: {T0}\n")
-                f.write(f"T1: {T1}\n")
+    
+    # 没有数据行时拆分坐标得不到任何列，无需解析
+    if df.empty:
+        rows = ()
+    else:
+        # 一次性向量化解析所有行（只做不会抛出异常的转换，单行的错误在下面的循环中逐行报告）
+        original_names = df['gcn_name'].astype(str).str.strip()
+        # 正则无法提取的名称为NaN，在循环中交给format_grb_name处理
+        extracted_names = 'GRB' + original_names.str.extract(_GRB_RE, expand=False).str.upper()
+        
+        ra_dec_all = df['ra,dec'].astype(str).str.strip()
+        valid_ra_dec = ra_dec_all.str.count(',') == 1
+        ra_dec_parts = ra_dec_all.where(valid_ra_dec, ',').str.split(',', n=1, expand=True)
+        ra_all = pd.to_numeric(ra_dec_parts[0].str.strip(), errors='coerce')
+        dec_all = pd.to_numeric(ra_dec_parts[1].str.strip(), errors='coerce')
+        pindex_all = df['PIndex'] if 'PIndex' in df.columns else ['N/A'] * len(df)  # 有些可能缺失
+        
+        rows = zip(df.index, original_names, extracted_names, df['trigger_met'], df['T0'], df['T1'],
+                   ra_dec_all, valid_ra_dec, ra_all, dec_all, pindex_all)
+    
+    # 同一批文件使用相同的生成时间
+    generated_at = datetime.now()
+    
+    # 文件写入互不相关，交给线程池并行执行；成功的条目只计数，出错的按表格顺序打印
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        tasks = []
+        for idx, original_gcn_name, formatted_gcn_name, trigger_met, T0, T1, ra_dec, ra_dec_ok, ra, dec, pindex in rows:
+            try:
+                if pd.isna(formatted_gcn_name):
+                    formatted_gcn_name = format_grb_name(original_gcn_name)
+                
+                # 如果名称发生了变化，显示转换信息
+                if original_gcn_name != formatted_gcn_name:
+                    print(f"[格式化] {original_gcn_name} -> {formatted_gcn_name}")
                 
-            print(f"[✓] 第{idx+1}条: {formatted_gcn_name} -> {txt_path}")
-            processed_count += 1
-            
-        except Exception as e:
-            print(f"[✗] 处理第{idx+1}条记录时出错: {str(e)}")
-            skipped_count += 1
-            continue
+                if not ra_dec_ok:
+                    print(f"警告: {formatted_gcn_name} 的ra,dec格式不正确: '{ra_dec}'，跳过此条")
+                    skipped_count += 1
+                    continue
+                
+                if pd.isna(ra) or pd.isna(dec):
+                    raise ValueError(f"无法将ra,dec转换为数值: '{ra_dec}'")
+                
+                future = executor.submit(_write_grb_txt, base_dir, original_gcn_name, formatted_gcn_name,
+                                         trigger_met, ra, dec, pindex, T0, T1, generated_at)
+                tasks.append((idx, future))
+            except Exception as e:
+                print(f"[✗] 处理第{idx+1}条记录时出错: {str(e)}")
+                skipped_count += 1
+        
+        for idx, future in tasks:
+            try:
+                future.result()
+                processed_count += 1
+            except Exception as e:
+                print(f"[✗] 处理第{idx+1}条记录时出错: {str(e)}")
+                skipped_count += 1
 
     # 输出处理统计
     print(f"\n=== 处理完成统计 ===")
@@ -1,22 +1,27 @@
 import os 
+import matplotlib
+# 批量分析只保存图像，在导入pyplot/fermipy之前固定使用非交互式后端
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
 import numpy as np
 from fermipy.gtanalysis import GTAnalysis
 import astropy.io.fits as pyfits
-import matplotlib.pyplot as plt
-import pandas as pd
-import threading
 import concurrent.futures
-from queue import Queue
+import multiprocessing as mp
+from queue import Queue, SimpleQueue, Empty
 import time
 from datetime import datetime
 import logging
 import argparse
+import functools
+import mmap
 import sys
 from astropy.coordinates import SkyCoord
 import astropy.units as u
 from Generate_gconfig import parse_grb_info as parse_grb_info_from_module
 # 导入photon_analyzer模块中的函数
 from photon_analyzer import find_highest_prob_photon, save_all_photons
+from sed_plotter import save_sed_plot
 from cleandir import clean_results_directory
 from Generate_gconfig import create_config
 # 配置参数
@@ -24,15 +29,26 @@ BASE_DIR = "/home/mxr/lee/data/fermilat"
 TEMPLATE_CONFIG = "/home/mxr/lee/config.yaml"  # 标准配置文件模板
 GRB_DATA_DIR = os.path.join(BASE_DIR, "grb_data")
 RESULTS_DIR = os.path.join(BASE_DIR, "resultsPL")
+PHOTONS_MIN_PROB = 0.01  # 光子表只保存概率大于该值的光子，为None时保存全部光子
+# 批量分析时所有GRB的光子信息汇总，文件名注明概率筛选阈值
+ALL_PHOTONS_FILE = os.path.join(
+    RESULTS_DIR,
+    "all_grbs_photons.csv" if PHOTONS_MIN_PROB is None else f"all_grbs_photons_p{PHOTONS_MIN_PROB:g}.csv")
+
+# 多进程配置
+def _available_cpu_count():
+    """当前进程可用的CPU核数（遵守taskset/cgroup限制的CPU亲和性）"""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
 
-# 多线程配置
-MAX_WORKERS = 4  # 最大并行线程数
+MAX_WORKERS = _available_cpu_count()  # 默认并行进程数：每个可用核一个拟合进程
 THREAD_TIMEOUT = 3600  # 单个任务超时时间（秒）
 
 # 设置多线程日志
 def setup_logging():
     """设置多线程安全的日志系统"""
-    log_format = '%(asctime)s - %(threadName)s - %(levelname)s - %(message)s'
+    log_format = '%(asctime)s - %(processName)s - %(levelname)s - %(message)s'
     logging.basicConfig(
         level=logging.INFO,
         format=log_format,
@@ -45,218 +61,265 @@ def setup_logging():
 
 logger = setup_logging()
 
-# 线程安全的结果收集器
+# 线程安全的结果收集器：add_*只向队列追加记录，读取结果时再整理成字典
 class ResultCollector:
     def __init__(self):
-        self._lock = threading.Lock()
+        self._queue = SimpleQueue()
         self._results = {}
         self._errors = {}
     
     def add_result(self, grb_name, result):
-        with self._lock:
-            self._results[grb_name] = result
-            logger.info(f"✅ {grb_name} 分析完成")
+        self._queue.put((True, grb_name, result))
+        logger.info(f"✅ {grb_name} 分析完成")
     
     def add_error(self, grb_name, error):
-        with self._lock:
-            self._errors[grb_name] = str(error)
-            logger.error(f"❌ {grb_name} 分析失败: {error}")
+        self._queue.put((False, grb_name, str(error)))
+        logger.error(f"❌ {grb_name} 分析失败: {error}")
+    
+    def _drain(self):
+        """把队列中的新记录合并到结果字典（由读取结果的线程调用）"""
+        while True:
+            try:
+                ok, grb_name, value = self._queue.get_nowait()
+            except Empty:
+                return
+            if ok:
+                self._results[grb_name] = value
+            else:
+                self._errors[grb_name] = value
     
     def get_results(self):
-        with self._lock:
-            return self._results.copy(), self._errors.copy()
+        self._drain()
+        return self._results.copy(), self._errors.copy()
     
     def get_summary(self):
-        with self._lock:
-            return len(self._results), len(self._errors)
+        self._drain()
+        return len(self._results), len(self._errors)
 
 def parse_grb_info(grb_dir):
     """解析GRB信息文件（调用Generate_gconfig模块）"""
     grb_name = os.path.basename(grb_dir)
     return parse_grb_info_from_module(grb_name, RESULTS_DIR)
 
-def analyze_grb_worker(grb_name, result_collector):
-    """执行单个GRB的分析流程（线程安全版本）"""
-    thread_id = threading.current_thread().name
+def _analyze_grb(grb_name, photons_summary_file=None):
+    """执行单个GRB的分析流程，成功时返回分析结果字典，失败时抛出异常
+    
+    photons_summary_file不为None时，该GRB的光子信息同时追加到这个汇总CSV文件。
+    只有拟合成功的GRB才会追加：追加发生在最后一个可能导致分析失败的检查之后。
+    """
+    # 进程池中每个任务运行在独立进程里，以进程名区分各个任务
+    worker_id = mp.current_process().name
     start_time = time.time()
     
+    # 该GRB用到的所有输出路径只计算一次
+    grb_result_dir = os.path.join(RESULTS_DIR, grb_name)
+    config_path = os.path.join(grb_result_dir, "config.yaml")
+    fit0_base = os.path.join(grb_result_dir, "fit0")
+    fit_npy_path = fit0_base + ".npy"
+    sed_image_path = os.path.join(grb_result_dir, f'{grb_name}_sed.png')
+    result_path = os.path.join(grb_result_dir, f"{grb_name}_fit_results.txt")
+    
+    logger.info(f"[{worker_id}] {'='*40}")
+    logger.info(f"[{worker_id}] 开始分析: {grb_name}")
+    logger.info(f"[{worker_id}] {'='*40}")
+    
+    grb_params = parse_grb_info(os.path.join(GRB_DATA_DIR, grb_name))
+    
+    # 1.清理结果目录
+    clean_results_directory(target_dir=grb_result_dir, keep_patterns=['GRB*.txt'])
+
+    # 2.创建配置文件
+    create_config(grb_name, grb_params, output_dir=grb_result_dir)
+
+    # 3. 设置分析环境
     try:
-        logger.info(f"[{thread_id}] {'='*40}")
-        logger.info(f"[{thread_id}] 开始分析: {grb_name}")
-        logger.info(f"[{thread_id}] {'='*40}")
+        gta = GTAnalysis(config_path, logging={'verbosity': 1})  # 降低日志级别避免冲突
+        gta.setup()
+        logger.info(f"[{worker_id}] {grb_name} FermiPy 环境初始化成功")
+    except Exception as e:
+        raise Exception(f"初始化失败: {str(e)}")
+    
+    # 5. 打印初始ROI模型
+    try:
+        gta.print_roi()
+        logger.info(f"[{worker_id}] {grb_name} ROI模型打印完成")
+    except Exception as e:
+        logger.warning(f"[{worker_id}] {grb_name} 打印ROI失败: {str(e)}")
+    
+    # 6. 设置拟合参数
+    try:
+        # 释放附近源
+        gta.free_sources(distance=2.5, pars='norm')
         
-        grb_params = parse_grb_info(os.path.join(GRB_DATA_DIR, grb_name))
+        # 释放弥散背景
+        gta.free_source('galdiff')
+        gta.free_source('isodiff')
+        
+        # 释放目标GRB
+        gta.free_source(grb_name)
 
-        config_path = os.path.join(RESULTS_DIR, grb_name, "config.yaml")
+        gta.optimize()
+        logger.info(f"[{worker_id}] {grb_name} 拟合参数设置完成")
+    except Exception as e:
+        logger.warning(f"[{worker_id}] {grb_name} 设置拟合参数失败: {str(e)}")
+    
+    # 7. 执行拟合
+    try:
+        fit_results = gta.fit()
+        logger.info(f"[{worker_id}] {grb_name} 拟合结果:")
+        logger.info(f"[{worker_id}] {grb_name} Fit Quality: {fit_results['fit_quality']}")
+        logger.info(f"[{worker_id}] {grb_name} 目标源信息: {gta.roi[grb_name]}")
         
-        # 1.清理结果目录
-        clean_results_directory(target_dir=os.path.join(RESULTS_DIR, grb_name), keep_patterns=['GRB*.txt'])
+    except Exception as e:
+        raise Exception(f"拟合失败: {str(e)}")
+    if not fit_results:
+        raise Exception("拟合失败")
+    # 8. TSMAP and residmap
+    gta.write_roi(fit0_base, make_plots=True)
+    # fermipy的npy是pickle的对象数组，无法内存映射；取出结果字典后立即释放数组
+    c = None
+    try:
+        fit_array = np.load(fit_npy_path, allow_pickle=True)
+        c = fit_array.flat[0]
+        del fit_array
+    except Exception as e:
+        logger.warning(f"[{worker_id}] {grb_name} 加载拟合结果npy失败: {str(e)}")
 
-        # 2.创建配置文件
-        create_config(grb_name, grb_params, output_dir=os.path.join(RESULTS_DIR, grb_name))
+    # 8. 执行SED分析
+    try:
+        # 绘制SED图像并保存到各个GRB分析文件夹
+        sed = gta.sed(f'{grb_name}',loge_bins=np.linspace(2, 5, num=6),use_local_index=True)
+        save_sed_plot(c, sed, f'{grb_name}', sed_image_path)
+    except Exception as e:
+        logger.warning(f"[{worker_id}] {grb_name} SED分析失败: {str(e)}")
 
-        # 3. 设置分析环境
+    # 9. 获取最高能高概率光子信息（在拟合后进行）
+    # 光子信息在这里追加到汇总文件，此后的步骤都不会再让该GRB的分析失败
+    highest_photon = find_highest_prob_photon(gta, grb_name, grb_params, RESULTS_DIR,
+                                              photons_summary_file=photons_summary_file,
+                                              photons_min_prob=PHOTONS_MIN_PROB)
+    # 10. 保存拟合结果（包含最高能光子信息和分析摘要）
+    if fit_results:
         try:
-            gta = GTAnalysis(config_path, logging={'verbosity': 1})  # 降低日志级别避免冲突
-            gta.setup()
-            logger.info(f"[{thread_id}] {grb_name} FermiPy 环境初始化成功")
-        except Exception as e:
-            raise Exception(f"初始化失败: {str(e)}")
-        
-        # 5. 打印初始ROI模型
-        try:
-            gta.print_roi()
-            logger.info(f"[{thread_id}] {grb_name} ROI模型打印完成")
-        except Exception as e:
-            logger.warning(f"[{thread_id}] {grb_name} 打印ROI失败: {str(e)}")
-        
-        # 6. 设置拟合参数
-        try:
-            # 释放附近源
-            gta.free_sources(distance=2.5, pars='norm')
+            analysis_time = time.time() - start_time
+            # 文件内容瞬间写完，分析时间与完成时间共用同一时间戳
+            completed_at = datetime.now()
             
-            # 释放弥散背景
-            gta.free_source('galdiff')
-            gta.free_source('isodiff')
+            with open(result_path, 'w') as f:
+                f.write(f"GRB Analysis Results for {grb_name}\n")
+                f.write("="*50 + "\n")
+                f.write(f"分析目录: {BASE_DIR}\n")
+                f.write(f"分析时间: {completed_at}\n")
+                f.write(f"分析耗时: {analysis_time:.2f}s\n")
+                f.write("\n")
+                
+                # 添加GRB基本参数信息（包含T0, T1）
+                f.write("GRB Parameters:\n")
+                f.write("-"*20 + "\n")
+                f.write(f"RA: {grb_params['ra']:.4f} deg\n")
+                f.write(f"Dec: {grb_params['dec']:.4f} deg\n")
+                f.write(f"Trigger MET: {grb_params['trigger_met']:.2f} s\n")
+                f.write(f"T0: {grb_params['T0']:.2f} s\n")
+                f.write(f"T1: {grb_params['T1']:.2f} s\n")
+                f.write(f"Time Range (tmin-tmax): {grb_params['tmin']:.2f} - {grb_params['tmax']:.2f} s\n")
+                if 'PIndex' in grb_params:
+                    f.write(f"PIndex: {grb_params['PIndex']}\n")
+                f.write("\n")
+                
+                # 添加拟合结果信息
+                f.write("Fit Results:\n")
+                f.write("-"*20 + "\n")
+                f.write(f"Fit Quality: {fit_results['fit_quality']}\n")
+                f.write(f"Log-Likelihood: {fit_results['loglike']:.2f}\n")
+                f.write(f"Target Source: {gta.roi[grb_name]}\n\n")
+                                   
+                # 添加最高能高概率光子信息
+                f.write("Highest Energy Photon Analysis:\n")
+                f.write("-"*30 + "\n")
+                if highest_photon:
+                    f.write("Highest Energy Photon (Probability > 0.9):\n")
+                    f.write(f"  Energy: {highest_photon['energy']:.2f} MeV\n")
+                    f.write(f"  Probability: {highest_photon['probability']:.4f}\n")
+                    f.write(f"  Time (MET): {highest_photon['time']:.2f} s\n")
+                    f.write(f"  Relative Time: {highest_photon['relative_time']:.2f} s\n")
+                    f.write(f"  RA: {highest_photon['ra']:.4f} deg\n")
+                    f.write(f"  Dec: {highest_photon['dec']:.4f} deg\n")
+                    f.write(f"  Angular Separation: {highest_photon['angular_separation']:.4f} deg\n")
+                    f.write(f"  Total High Prob Photons: {highest_photon['total_high_prob_photons']}\n")
+                    f.write(f"  Event Class: {highest_photon['event_class']}\n")
+                    f.write(f"  Event Type: {highest_photon['event_type']}\n")
+                else:
+                    f.write("Highest Energy Photon: Not found with probability > 0.9\n")
+                
+                f.write("\n")
+                f.write("="*50 + "\n")
+                f.write(f"Analysis completed at: {completed_at}\n")
             
-            # 释放目标GRB
-            gta.free_source(grb_name)
-
-            gta.optimize()
-            logger.info(f"[{thread_id}] {grb_name} 拟合参数设置完成")
-        except Exception as e:
-            logger.warning(f"[{thread_id}] {grb_name} 设置拟合参数失败: {str(e)}")
-        
-        # 7. 执行拟合
-        try:
-            fit_results = gta.fit()
-            logger.info(f"[{thread_id}] {grb_name} 拟合结果:")
-            logger.info(f"[{thread_id}] {grb_name} Fit Quality: {fit_results['fit_quality']}")
-            logger.info(f"[{thread_id}] {grb_name} 目标源信息: {gta.roi[grb_name]}")
+            logger.info(f"[{worker_id}] {grb_name} 拟合结果已保存: {result_path}")
             
+            # 将最高能光子信息添加到返回结果中
+            if highest_photon:
+                fit_results['highest_photon'] = highest_photon
+                
         except Exception as e:
-            raise Exception(f"拟合失败: {str(e)}")
-        # 8. TSMAP and residmap
-        output_base = os.path.join(RESULTS_DIR, grb_name, "fit0")
-        gta.write_roi(output_base, make_plots=True)
-        fit_npy_path = os.path.join(RESULTS_DIR, grb_name, "fit0.npy")
-        try:
-            c = np.load(fit_npy_path, allow_pickle=True).flat[0]
-        except Exception as e:
-            logger.warning(f"[{thread_id}] {grb_name} 加载拟合结果npy失败: {str(e)}")
+            logger.warning(f"[{worker_id}] {grb_name} 保存拟合结果失败: {str(e)}")
+    
+    # 11. 保存最终模型和图表
+    # try:
+    #     output_base = os.path.join(RESULTS_DIR, grb_name, "final_model")
+    #     gta.write_roi(output_base, make_plots=True)
+    #     logger.info(f"[{worker_id}] {grb_name} 最终模型和图表已保存: {output_base}.*")
+    # except Exception as e:
+    #     logger.warning(f"[{worker_id}] {grb_name} 保存最终模型失败: {str(e)}")
+    
+    # 收集结果
+    return {
+        'fit_results': fit_results,
+        'grb_params': grb_params,
+        'analysis_time': time.time() - start_time
+    }
 
-        # 8. 执行SED分析
-        try:
-            from sed_plotter import plot_sed, save_sed_plot
-            # 绘制SED图像
-            sed = gta.sed(f'{grb_name}',loge_bins=np.linspace(2, 5, num=6),use_local_index=True)
-            plot_sed(c, sed, f'{grb_name}')
-            # 保存图像到各个GRB分析文件夹
-            grb_result_dir = os.path.join(RESULTS_DIR, grb_name)
-            sed_image_path = os.path.join(grb_result_dir, f'{grb_name}_sed.png')
-            save_sed_plot(c, sed, f'{grb_name}', sed_image_path)
-        except Exception as e:
-            logger.warning(f"[{thread_id}] {grb_name} SED分析失败: {str(e)}")
+def analyze_grb_worker(grb_name, result_collector, photons_summary_file=None):
+    """执行单个GRB的分析流程，并把结果记录到result_collector中"""
+    try:
+        result_collector.add_result(grb_name, _analyze_grb(grb_name, photons_summary_file))
+    except Exception as e:
+        result_collector.add_error(grb_name, str(e))
 
-        # 9. 获取最高能高概率光子信息（在拟合后进行）
-        highest_photon = find_highest_prob_photon(gta, grb_name, grb_params, RESULTS_DIR)
-        # 10. 保存拟合结果（包含最高能光子信息和分析摘要）
-        if fit_results:
-            try:
-                result_path = os.path.join(RESULTS_DIR, grb_name, f"{grb_name}_fit_results.txt")
-                analysis_time = time.time() - start_time
-                
-                with open(result_path, 'w') as f:
-                    f.write(f"GRB Analysis Results for {grb_name}\n")
-                    f.write("="*50 + "\n")
-                    f.write(f"分析目录: {BASE_DIR}\n")
-                    f.write(f"分析时间: {pd.Timestamp.now()}\n")
-                    f.write(f"分析耗时: {analysis_time:.2f}s\n")
-                    f.write("\n")
-                    
-                    # 添加GRB基本参数信息（包含T0, T1）
-                    f.write("GRB Parameters:\n")
-                    f.write("-"*20 + "\n")
-                    f.write(f"RA: {grb_params['ra']:.4f} deg\n")
-                    f.write(f"Dec: {grb_params['dec']:.4f} deg\n")
-                    f.write(f"Trigger MET: {grb_params['trigger_met']:.2f} s\n")
-                    f.write(f"T0: {grb_params['T0']:.2f} s\n")
-                    f.write(f"T1: {grb_params['T1']:.2f} s\n")
-                    f.write(f"Time Range (tmin-tmax): {grb_params['tmin']:.2f} - {grb_params['tmax']:.2f} s\n")
-                    if 'PIndex' in grb_params:
-                        f.write(f"PIndex: {grb_params['PIndex']}\n")
-                    f.write("\n")
-                    
-                    # 添加拟合结果信息
-                    f.write("Fit Results:\n")
-                    f.write("-"*20 + "\n")
-                    f.write(f"Fit Quality: {fit_results['fit_quality']}\n")
-                    f.write(f"Log-Likelihood: {fit_results['loglike']:.2f}\n")
-                    f.write(f"Target Source: {gta.roi[grb_name]}\n\n")
-                                       
-                    # 添加最高能高概率光子信息
-                    f.write("Highest Energy Photon Analysis:\n")
-                    f.write("-"*30 + "\n")
-                    if highest_photon:
-                        f.write("Highest Energy Photon (Probability > 0.9):\n")
-                        f.write(f"  Energy: {highest_photon['energy']:.2f} MeV\n")
-                        f.write(f"  Probability: {highest_photon['probability']:.4f}\n")
-                        f.write(f"  Time (MET): {highest_photon['time']:.2f} s\n")
-                        f.write(f"  Relative Time: {highest_photon['relative_time']:.2f} s\n")
-                        f.write(f"  RA: {highest_photon['ra']:.4f} deg\n")
-                        f.write(f"  Dec: {highest_photon['dec']:.4f} deg\n")
-                        f.write(f"  Angular Separation: {highest_photon['angular_separation']:.4f} deg\n")
-                        f.write(f"  Total High Prob Photons: {highest_photon['total_high_prob_photons']}\n")
-                        f.write(f"  Event Class: {highest_photon['event_class']}\n")
-                        f.write(f"  Event Type: {highest_photon['event_type']}\n")
-                    else:
-                        f.write("Highest Energy Photon: Not found with probability > 0.9\n")
-                    
-                    f.write("\n")
-                    f.write("="*50 + "\n")
-                    f.write(f"Analysis completed at: {pd.Timestamp.now()}\n")
-                
-                logger.info(f"[{thread_id}] {grb_name} 拟合结果已保存: {result_path}")
-                
-                # 将最高能光子信息添加到返回结果中
-                if highest_photon:
-                    fit_results['highest_photon'] = highest_photon
-                    
-            except Exception as e:
-                logger.warning(f"[{thread_id}] {grb_name} 保存拟合结果失败: {str(e)}")
-        
-        # 11. 保存最终模型和图表
-        # try:
-        #     output_base = os.path.join(RESULTS_DIR, grb_name, "final_model")
-        #     gta.write_roi(output_base, make_plots=True)
-        #     logger.info(f"[{thread_id}] {grb_name} 最终模型和图表已保存: {output_base}.*")
-        # except Exception as e:
-        #     logger.warning(f"[{thread_id}] {grb_name} 保存最终模型失败: {str(e)}")
-        
-        # 收集结果
-        if fit_results:
-            analysis_result = {
-                'fit_results': fit_results,
-                'grb_params': grb_params,
-                'analysis_time': time.time() - start_time
-            }
-            result_collector.add_result(grb_name, analysis_result)
-        else:
-            result_collector.add_error(grb_name, "拟合失败")
+def _init_worker():
+    """进程池初始化：子进程中再次确认使用非交互式的matplotlib后端"""
+    matplotlib.use('Agg')
+
+def _analyze_grb_task(grb_name, photons_summary_file=None):
+    """进程池任务：分析单个GRB，返回可pickle的(GRB名称, 分析结果, 错误信息)
     
+    只保留汇总报告用到的拟合结果字段，避免把完整的fermipy结果传回主进程。
+    """
+    try:
+        analysis_result = _analyze_grb(grb_name, photons_summary_file)
     except Exception as e:
-        result_collector.add_error(grb_name, str(e))
-        logger.error(f"[{thread_id}] {grb_name} 分析异常: {str(e)}")
+        logger.error(f"[{mp.current_process().name}] {grb_name} 分析异常: {str(e)}")
+        return grb_name, None, str(e)
+    
+    fit_results = analysis_result['fit_results']
+    analysis_result['fit_results'] = {key: fit_results[key]
+                                      for key in ('fit_quality', 'loglike', 'highest_photon')
+                                      if key in fit_results}
+    return grb_name, analysis_result, None
+
+@functools.lru_cache(maxsize=1)
+def _scan_grb_dirs():
+    """扫描GRB数据目录（scandir直接给出条目类型，无需逐个stat），结果在进程内缓存"""
+    with os.scandir(GRB_DATA_DIR) as entries:
+        return tuple(sorted(entry.name for entry in entries
+                            if entry.name.startswith('GRB') and entry.is_dir()))
 
 def get_grb_list():
-    """获取待分析的GRB列表"""
-    grb_dirs = [d for d in os.listdir(GRB_DATA_DIR) 
-                if os.path.isdir(os.path.join(GRB_DATA_DIR, d))
-                and d.startswith('GRB')]
-    return grb_dirs
+    """获取待分析的GRB列表（按名称排序）"""
+    return list(_scan_grb_dirs())
 
 def analyze_grb_multithread(grb_list=None, max_workers=MAX_WORKERS):
-    """多线程分析多个GRB"""
+    """多进程并行分析多个GRB（每个GRB在独立进程中拟合，不受GIL限制）"""
     
     if grb_list is None:
         grb_list = get_grb_list()
@@ -267,17 +330,23 @@ def analyze_grb_multithread(grb_list=None, max_workers=MAX_WORKERS):
     
     logger.info(f"🎯 准备分析 {len(grb_list)} 个GRB文件")
     logger.info(f"📋 GRB列表: {', '.join(grb_list)}")
-    logger.info(f"🔧 使用 {max_workers} 个线程")
+    logger.info(f"🔧 使用 {max_workers} 个进程")
     
     result_collector = ResultCollector()
     start_time = time.time()
     
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, 
-                                               thread_name_prefix="GRB-Worker") as executor:
+    # 各进程把光子信息直接追加到汇总文件，先删除上次运行留下的文件
+    if os.path.exists(ALL_PHOTONS_FILE):
+        os.remove(ALL_PHOTONS_FILE)
+    
+    # fermipy/matplotlib的全局状态不是线程安全的，使用spawn方式启动的独立进程
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers,
+                                                mp_context=mp.get_context('spawn'),
+                                                initializer=_init_worker) as executor:
         
         future_to_grb = {}
         for grb_name in grb_list:
-            future = executor.submit(analyze_grb_worker, grb_name, result_collector)
+            future = executor.submit(_analyze_grb_task, grb_name, ALL_PHOTONS_FILE)
             future_to_grb[future] = grb_name
         
         completed = 0
@@ -288,7 +357,12 @@ def analyze_grb_multithread(grb_list=None, max_workers=MAX_WORKERS):
             completed += 1
             
             try:
-                future.result()
+                _, analysis_result, error = future.result()
+                # 结果由主进程统一收集
+                if error is None:
+                    result_collector.add_result(grb_name, analysis_result)
+                else:
+                    result_collector.add_error(grb_name, error)
                 success_count, error_count = result_collector.get_summary()
                 logger.info(f"📊 进度: {completed}/{total} | 成功: {success_count} | 失败: {error_count}")
                 
@@ -296,13 +370,14 @@ def analyze_grb_multithread(grb_list=None, max_workers=MAX_WORKERS):
                 logger.error(f"⏰ {grb_name} 分析超时")
                 result_collector.add_error(grb_name, "分析超时")
             except Exception as e:
-                logger.error(f"💥 {grb_name} 线程异常: {str(e)}")
+                logger.error(f"💥 {grb_name} 进程异常: {str(e)}")
+                result_collector.add_error(grb_name, str(e))
     
     results, errors = result_collector.get_results()
     total_time = time.time() - start_time
     
     logger.info(f"\n{'='*60}")
-    logger.info(f"🎉 多线程分析完成!")
+    logger.info(f"🎉 多进程分析完成!")
     logger.info(f"⏱️  总耗时: {total_time:.2f} 秒")
     logger.info(f"✅ 成功: {len(results)} 个")
     logger.info(f"❌ 失败: {len(errors)} 个")
@@ -337,8 +412,13 @@ def analyze_single_grb(grb_name):
     result_collector = ResultCollector()
     start_time = time.time()
     
+    # 该GRB的光子信息写入单独的汇总文件，先删除上次运行留下的文件
+    photons_file = os.path.join(RESULTS_DIR, f"{grb_name}_photons.csv")
+    if os.path.exists(photons_file):
+        os.remove(photons_file)
+    
     # 执行分析
-    analyze_grb_worker(grb_name, result_collector)
+    analyze_grb_worker(grb_name, result_collector, photons_file)
     
     # 获取结果
     results, errors = result_collector.get_results()
@@ -356,16 +436,38 @@ def analyze_single_grb(grb_name):
     
     return results, errors
 
+def _find_line_starting_with(binary_file, prefix):
+    """
+    在以二进制方式打开的文件中查找第一个以prefix开头的行
+    
+    通过mmap在整个文件上直接做字节查找，不逐行解码；找到时返回该行文本（不含换行符），否则返回None。
+    """
+    if os.fstat(binary_file.fileno()).st_size == 0:
+        return None  # 空文件无法mmap
+    with mmap.mmap(binary_file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        # 只接受位于行首的匹配
+        if mm[:len(prefix)] == prefix:
+            start = 0
+        else:
+            start = mm.find(b"\n" + prefix)
+            if start < 0:
+                return None
+            start += 1
+        end = mm.find(b"\n", start)
+        if end < 0:
+            end = len(mm)
+        return mm[start:end].decode('utf-8', errors='replace').rstrip('\r')
+
 def parse_arguments():
     """解析命令行参数"""
     parser = argparse.ArgumentParser(
-        description='GRB数据分析工具 - 支持多线程批量分析或单个GRB分析',
+        description='GRB数据分析工具 - 支持多进程批量分析或单个GRB分析',
         formatter_class=argparse.RawDescriptionHelpFormatter,
         epilog="""使用示例:
-  python lkmulty.py                    # 分析所有GRB（多线程）
+  python lkmulty.py                    # 分析所有GRB（多进程）
   python lkmulty.py --grb GRB090510    # 分析指定的单个GRB
   python lkmulty.py --list             # 列出所有可用的GRB
-  python lkmulty.py --workers 8        # 使用8个线程进行批量分析"""
+  python lkmulty.py --workers 8        # 使用8个进程进行批量分析"""
     )
     
     parser.add_argument(
@@ -384,7 +486,8 @@ def parse_arguments():
         '--workers', 
         type=int, 
         default=MAX_WORKERS,
-        help=f'多线程分析时的线程数量（默认：{MAX_WORKERS}）'
+        help=f'多进程分析时的进程数量（默认：可用CPU核数，当前为{MAX_WORKERS}；'
+             '拟合以CPU计算为主，超过核数通常不会更快）'
     )
     
     return parser.parse_args()
@@ -407,7 +510,7 @@ def main():
             grb_list = get_grb_list()
             if grb_list:
                 logger.info(f"📋 发现 {len(grb_list)} 个可用的GRB事件:")
-                for i, grb in enumerate(sorted(grb_list), 1):
+                for i, grb in enumerate(grb_list, 1):
                     logger.info(f"  {i:2d}. {grb}")
             else:
                 logger.warning(f"❌ 在目录 {GRB_DATA_DIR} 中未找到任何GRB数据")
@@ -417,8 +520,8 @@ def main():
         if args.grb:
             results, errors = analyze_single_grb(args.grb)
         else:
-            # 开始多线程分析所有GRB
-            logger.info(f"🔧 使用 {args.workers} 个线程进行批量分析")
+            # 开始多进程分析所有GRB
+            logger.info(f"🔧 使用 {args.workers} 个进程进行批量分析")
             
             # 为所有GRB生成config文件
             grb_list = get_grb_list()
@@ -443,103 +546,91 @@ def main():
                 summary_path = os.path.join(RESULTS_DIR, f"{args.grb}_analysis_summary.txt")
                 report_title = f"GRB单个事件分析报告: {args.grb}"
             else:
-                # 多线程批量分析报告
+                # 多进程批量分析报告
                 summary_path = os.path.join(RESULTS_DIR, "analysis_summary.txt")
-                report_title = "GRB多线程分析汇总报告"
+                report_title = "GRB多进程分析汇总报告"
             
-            with open(summary_path, 'w') as f:
-                f.write(f"{report_title}\n")
-                f.write("="*50 + "\n")
-                f.write(f"分析目录: {BASE_DIR}\n")
-                f.write(f"分析时间: {pd.Timestamp.now()}\n")
-                f.write(f"成功分析: {len(results)} 个GRB\n")
-                f.write(f"失败分析: {len(errors)} 个GRB\n\n")
+            # 每个GRB的内容先拼接成列表，再一次性写入（大缓冲区减少系统调用）
+            with open(summary_path, 'w', buffering=1 << 20) as f:
+                f.write(
+                    f"{report_title}\n"
+                    + "="*50 + "\n"
+                    f"分析目录: {BASE_DIR}\n"
+                    f"分析时间: {datetime.now()}\n"
+                    f"成功分析: {len(results)} 个GRB\n"
+                    f"失败分析: {len(errors)} 个GRB\n\n"
+                )
                 
+                # 循环内反复用到的方法和常量先绑定为局部变量
+                write = f.write
+                join_path = os.path.join
+                section_rule = "="*30 + "\n"
                 for grb, result_data in results.items():
                     fit_results = result_data['fit_results']
                     grb_params = result_data['grb_params']
-                    f.write(f"{grb}:\n")
-                    f.write("="*30 + "\n")
-                    f.write(f"  分析时间: {result_data['analysis_time']:.2f}s\n")
-                    f.write(f"  Fit Quality: {fit_results.get('fit_quality', 'N/A')}\n")
-                    f.write(f"  Log-Likelihood: {fit_results.get('loglike', 'N/A')}\n")
-                    
-                    # 添加GRB基本参数信息
-                    f.write("  GRB参数:\n")
-                    f.write(f"    RA: {grb_params['ra']:.4f} deg\n")
-                    f.write(f"    Dec: {grb_params['dec']:.4f} deg\n")
-                    f.write(f"    Trigger MET: {grb_params['trigger_met']:.2f} s\n")
-                    f.write(f"    T0: {grb_params['T0']:.2f} s\n")
-                    f.write(f"    T1: {grb_params['T1']:.2f} s\n")
-                    f.write(f"    Time Range: {grb_params['tmin']:.2f} - {grb_params['tmax']:.2f} s\n")
+                    fit_get = fit_results.get
+                    parts = [
+                        f"{grb}:\n",
+                        section_rule,
+                        f"  分析时间: {result_data['analysis_time']:.2f}s\n",
+                        f"  Fit Quality: {fit_get('fit_quality', 'N/A')}\n",
+                        f"  Log-Likelihood: {fit_get('loglike', 'N/A')}\n",
+                        # 添加GRB基本参数信息
+                        "  GRB参数:\n",
+                        f"    RA: {grb_params['ra']:.4f} deg\n",
+                        f"    Dec: {grb_params['dec']:.4f} deg\n",
+                        f"    Trigger MET: {grb_params['trigger_met']:.2f} s\n",
+                        f"    T0: {grb_params['T0']:.2f} s\n",
+                        f"    T1: {grb_params['T1']:.2f} s\n",
+                        f"    Time Range: {grb_params['tmin']:.2f} - {grb_params['tmax']:.2f} s\n",
+                    ]
                     if 'PIndex' in grb_params:
-                        f.write(f"    PIndex: {grb_params['PIndex']}\n")
+                        parts.append(f"    PIndex: {grb_params['PIndex']}\n")
                                      
-                    if 'highest_photon' in fit_results and fit_results['highest_photon']:
-                        hp = fit_results['highest_photon']
-                        f.write("  最高能光子信息:\n")
-                        f.write(f"    能量: {hp['energy']:.2f} MeV\n")
-                        f.write(f"    概率: {hp['probability']:.4f}\n")
-                        f.write(f"    相对时间: {hp['relative_time']:.2f} s\n")
-                        f.write(f"    RA: {hp['ra']:.4f} deg\n")
-                        f.write(f"    Dec: {hp['dec']:.4f} deg\n")
-                        f.write(f"    角分离: {hp['angular_separation']:.4f} deg\n")
-                        f.write(f"    高概率光子总数: {hp['total_high_prob_photons']}\n")
-                        f.write(f"    事件类型: {hp['event_class']}, {hp['event_type']}\n")
+                    hp = fit_get('highest_photon')
+                    if hp:
+                        parts += [
+                            "  最高能光子信息:\n",
+                            f"    能量: {hp['energy']:.2f} MeV\n",
+                            f"    概率: {hp['probability']:.4f}\n",
+                            f"    相对时间: {hp['relative_time']:.2f} s\n",
+                            f"    RA: {hp['ra']:.4f} deg\n",
+                            f"    Dec: {hp['dec']:.4f} deg\n",
+                            f"    角分离: {hp['angular_separation']:.4f} deg\n",
+                            f"    高概率光子总数: {hp['total_high_prob_photons']}\n",
+                            f"    事件类型: {hp['event_class']}, {hp['event_type']}\n",
+                        ]
                     else:
-                        f.write("  最高能光子: 未找到概率>0.9的光子\n")
+                        parts.append("  最高能光子: 未找到概率>0.9的光子\n")
                     
-                    # 尝试从详细结果文件中读取更多信息
+                    # 尝试从详细结果文件中读取更多信息（直接打开，文件不存在时跳过，省去一次stat）
                     try:
-                        result_file_path = os.path.join(RESULTS_DIR, grb, f"{grb}_fit_results.txt")
-                        if os.path.exists(result_file_path):
-                            f.write("  详细分析结果:\n")
-                            with open(result_file_path, 'r') as detail_file:
-                                lines = detail_file.readlines()
-                                # 查找目标源信息
-                                for i, line in enumerate(lines):
-                                    if "Target Source:" in line:
-                                        f.write(f"    目标源信息: {line.split('Target Source:')[1].strip()}\n")
-                                        break
+                        result_file_path = join_path(RESULTS_DIR, grb, f"{grb}_fit_results.txt")
+                        with open(result_file_path, 'rb') as detail_file:
+                            parts.append("  详细分析结果:\n")
+                            target_line = _find_line_starting_with(detail_file, b"Target Source:")
+                            if target_line is not None:
+                                parts.append(f"    目标源信息: {target_line.split('Target Source:', 1)[1].strip()}\n")
+                    except FileNotFoundError:
+                        pass
                     except Exception as e:
-                        f.write(f"  详细信息读取失败: {str(e)}\n")
+                        parts.append(f"  详细信息读取失败: {str(e)}\n")
                     
-                    f.write("\n")
+                    parts.append("\n")
+                    write("".join(parts))
                 
                 if errors:
-                    f.write("失败的GRB:\n")
-                    for grb, error in errors.items():
-                        f.write(f"  {grb}: {error}\n")
+                    f.write("失败的GRB:\n" + "".join(f"  {grb}: {error}\n" for grb, error in errors.items()))
             
             logger.info(f"汇总报告已保存: {summary_path}")
             
-            # 生成光子信息的汇总报告
-            try:
-                all_photons_summary = []
-                for grb, result_data in results.items():
-                    grb_dir = os.path.join(RESULTS_DIR, grb)
-                    all_photons_file = os.path.join(grb_dir, f"{grb}_all_photons.csv")
-                    if os.path.exists(all_photons_file):
-                        df = pd.read_csv(all_photons_file)
-                        df['GRB'] = grb  # 添加GRB名称列
-                        all_photons_summary.append(df)
-                
-                if all_photons_summary:
-                    # 合并所有GRB的光子信息
-                    combined_df = pd.concat(all_photons_summary, ignore_index=True)
-                    
-                    if args.grb:
-                        # 单个GRB的光子信息
-                        combined_path = os.path.join(RESULTS_DIR, f"{args.grb}_photons.csv")
-                        logger.info(f"单个GRB的光子信息已保存: {combined_path}")
-                    else:
-                        # 所有GRB的光子信息汇总
-                        combined_path = os.path.join(RESULTS_DIR, "all_grbs_photons.csv")
-                        logger.info(f"所有GRB的光子信息汇总已保存: {combined_path}")
-                    
-                    combined_df.to_csv(combined_path, index=False)
-            except Exception as e:
-                logger.error(f"生成光子信息汇总报告失败: {str(e)}")
+            # 光子信息已在分析过程中直接追加到汇总文件
+            if args.grb:
+                photons_file = os.path.join(RESULTS_DIR, f"{args.grb}_photons.csv")
+                if os.path.exists(photons_file):
+                    logger.info(f"单个GRB的光子信息已保存: {photons_file}")
+            elif os.path.exists(ALL_PHOTONS_FILE):
+                logger.info(f"所有GRB的光子信息汇总已保存: {ALL_PHOTONS_FILE}")
         
     except KeyboardInterrupt:
         logger.info("用户中断分析")
@@ -9,80 +9,155 @@
 """
 
 import os
+import math
 import numpy as np
 import astropy.io.fits as pyfits
 import pandas as pd
 import threading
 import logging
-from astropy.coordinates import SkyCoord
-import astropy.units as u
+
+try:
+    import fcntl
+except ImportError:  # Windows没有fcntl，只能在进程内加锁
+    fcntl = None
+
+# 没有fcntl时，同一进程内的追加写入用这个锁串行化
+_summary_lock = threading.Lock()
 
 # 设置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def save_all_photons(events, prob_col, grb_name, grb_params, output_dir):
+def _native_column(column, dtype=None):
+    """把FITS列转换为本机字节序的连续numpy数组（dtype为None时保持原精度）"""
+    column = np.asarray(column)
+    if dtype is None:
+        dtype = column.dtype.newbyteorder('=')
+    return np.ascontiguousarray(column, dtype=dtype)
+
+def _append_to_photons_summary(photons_df, grb_name, summary_file):
+    """
+    把单个GRB的光子信息（附加GRB列）追加到多个GRB共用的汇总CSV文件
+    
+    多个分析进程可能同时追加，用文件锁（fcntl.flock）保证每次写入完整；文件为空时先写表头。
+    没有fcntl的平台（Windows）上只能用进程内的锁，多个进程同时追加时无法互斥。
+    """
+    with open(summary_file, 'a', newline='') as f:
+        if fcntl is None:
+            _summary_lock.acquire()
+        else:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            write_header = os.fstat(f.fileno()).st_size == 0
+            photons_df.assign(GRB=grb_name).to_csv(f, header=write_header, index=False)
+            f.flush()
+        finally:
+            if fcntl is None:
+                _summary_lock.release()
+            else:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+def _write_photon_table(photons_df, base_path):
+    """
+    把光子表保存为Parquet文件（base_path.parquet），返回实际保存的文件路径
+    
+    数值列用Parquet存储比CSV小得多、读回也快；未安装Parquet引擎（pyarrow/fastparquet）时保存为CSV。
+    """
+    parquet_file = base_path + '.parquet'
+    try:
+        photons_df.to_parquet(parquet_file, compression='snappy', index=False)
+        return parquet_file
+    except ImportError as e:
+        logger.debug("未安装Parquet引擎，改为保存CSV: %s", e)
+    csv_file = base_path + '.csv'
+    photons_df.to_csv(csv_file, index=False)
+    return csv_file
+
+def save_all_photons(events, prob_col, grb_name, grb_params, output_dir, summary_file=None, min_prob=None):
     """
     保存所有光子信息，包括概率和到达时间
     
     参数:
-        events: FITS事件数据
+        events: 列名到本机字节序数组的字典，至少包含ENERGY、TIME、RA、DEC和概率列
         prob_col: 概率列名
         grb_name: GRB名称
         grb_params: GRB参数字典
         output_dir: 输出目录
+        summary_file: 多个GRB共用的光子汇总CSV文件，提供时同时把光子信息追加到该文件
+                      （单个GRB的光子表保存为Parquet，汇总文件由多个进程追加，仍为CSV）
+        min_prob: 只保存概率大于该值的光子，默认None时保存全部光子；
+                  为None时保存为{grb_name}_all_photons，否则保存为{grb_name}_photons_p{min_prob}
     
     返回:
         str: 保存文件路径
     """
     try:
         thread_id = threading.current_thread().name
-        logger.info(f"[{thread_id}] {grb_name} 开始保存所有光子信息...")
         
         # 检查输入参数
         if events is None:
             logger.error(f"[{thread_id}] {grb_name} events数据为None")
             return None
             
-        if prob_col not in events.dtype.names:
+        if prob_col not in events:
             logger.error(f"[{thread_id}] {grb_name} 概率列 '{prob_col}' 不存在于events数据中")
-            logger.error(f"[{thread_id}] {grb_name} 可用列名: {list(events.dtype.names)}")
+            logger.error(f"[{thread_id}] {grb_name} 可用列名: {list(events)}")
             return None
             
         if 'trigger_met' not in grb_params:
             logger.error(f"[{thread_id}] {grb_name} grb_params中缺少trigger_met参数")
             return None
         
-        logger.info(f"[{thread_id}] {grb_name} 事件总数: {len(events)}")
-        logger.info(f"[{thread_id}] {grb_name} 使用概率列: {prob_col}")
-        logger.info(f"[{thread_id}] {grb_name} 输出目录: {output_dir}")
+        # 每个GRB的统计信息合并为一条多行日志，%格式的参数只在记录实际输出时才格式化
+        logger.info("[%s] %s 开始保存所有光子信息:\n  事件总数: %d\n  使用概率列: %s\n  输出目录: %s",
+                    thread_id, grb_name, len(events['TIME']), prob_col, output_dir)
+        
+        # 指定min_prob时，构建DataFrame前先按概率筛掉与该GRB无关的光子，
+        # 文件名中注明筛选阈值，以免与保存全部光子的文件混淆
+        columns = {name: events[name] for name in ('ENERGY', 'TIME', 'RA', 'DEC')}
+        columns['PROBABILITY'] = events[prob_col]
+        file_stem = f"{grb_name}_all_photons"
+        if min_prob is not None:
+            file_stem = f"{grb_name}_photons_p{min_prob:g}"
+            prob_mask = columns['PROBABILITY'] > min_prob
+            columns = {name: values[prob_mask] for name, values in columns.items()}
         
-        # 创建DataFrame保存所有光子信息
+        # 创建DataFrame保存光子信息
+        # 各列先转换为本机字节序数组，DataFrame直接使用这些数组而不再复制；
+        # 能量和坐标在FT1文件中本就是单精度，时间保持双精度
+        time = _native_column(columns['TIME'], np.float64)
         all_photons_df = pd.DataFrame({
-            'ENERGY': events['ENERGY'],
-            'TIME': events['TIME'],
-            'RELATIVE_TIME': events['TIME'] - grb_params['trigger_met'],  # 相对触发时间
-            'PROBABILITY': events[prob_col],
-            'RA': events['RA'],
-            'DEC': events['DEC']
-        })
+            'ENERGY': _native_column(columns['ENERGY'], np.float32),
+            'TIME': time,
+            'RELATIVE_TIME': time - np.float64(grb_params['trigger_met']),  # 相对触发时间
+            'PROBABILITY': _native_column(columns['PROBABILITY']),
+            'RA': _native_column(columns['RA'], np.float32),
+            'DEC': _native_column(columns['DEC'], np.float32)
+        }, copy=False)
         
         # 保存所有光子信息
         os.makedirs(output_dir, exist_ok=True)
-        all_photons_file = os.path.join(output_dir, f"{grb_name}_all_photons.csv")
-        all_photons_df.to_csv(all_photons_file, index=False)
-        logger.info(f"[{thread_id}] {grb_name} 所有光子信息已保存: {all_photons_file}")
-        logger.info(f"[{thread_id}] {grb_name} 保存的光子数量: {len(all_photons_df)}")
+        all_photons_file = _write_photon_table(all_photons_df,
+                                               os.path.join(output_dir, file_stem))
+        
+        # 直接追加到汇总文件，无需事后重新读取各GRB的CSV再合并
+        if summary_file:
+            _append_to_photons_summary(all_photons_df, grb_name, summary_file)
+        
+        logger.info("[%s] %s 所有光子信息已保存: %s\n  保存的光子数量: %d（%s）\n  汇总文件: %s",
+                    thread_id, grb_name, all_photons_file, len(all_photons_df),
+                    "全部" if min_prob is None else f"概率>{min_prob:g}",
+                    summary_file or "未追加")
         
         return all_photons_file
     except Exception as e:
         thread_id = threading.current_thread().name
-        logger.error(f"[{thread_id}] {grb_name} 保存所有光子信息失败: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        # logger.exception自带异常堆栈，%格式的参数只在记录实际输出时才格式化
+        logger.exception("[%s] %s 保存所有光子信息失败: %s", thread_id, grb_name, e)
         return None
 
-def find_highest_prob_photon(gta, grb_name, grb_params, results_dir=None, prob_threshold=0.9):
+def find_highest_prob_photon(gta, grb_name, grb_params, results_dir=None, prob_threshold=0.9,
+                             photons_summary_file=None, photons_min_prob=0.01):
     """
     使用srcprob方法找到概率大于指定阈值的最高能光子
     
@@ -92,6 +167,8 @@ def find_highest_prob_photon(gta, grb_name, grb_params, results_dir=None, prob_t
         grb_params: dict, GRB参数字典，包含ra, dec, trigger_met等
         results_dir: str, 结果保存目录，默认为None时使用当前目录
         prob_threshold: float, 概率阈值，默认0.9
+        photons_summary_file: str, 多个GRB共用的光子汇总CSV文件，默认为None时不追加
+        photons_min_prob: float, 光子表只保存概率大于该值的光子，默认0.01；为None时保存全部光子
     
     返回:
         dict: 包含最高能光子详细信息的字典，失败时返回None
@@ -123,15 +200,14 @@ def find_highest_prob_photon(gta, grb_name, grb_params, results_dir=None, prob_t
             logger.warning(f"[{thread_id}] {grb_name} 未找到srcprob文件: {srcprob_file}")
             return None
         
-        logger.info(f"[{thread_id}] {grb_name} 找到srcprob文件: {srcprob_file}")
-        
         # 读取srcprob文件
         with pyfits.open(srcprob_file) as hdul:
             events = hdul['EVENTS'].data
             
             # 检查可用的列名
             available_columns = list(events.dtype.names)
-            logger.info(f"[{thread_id}] {grb_name} 可用列名: {available_columns}")
+            logger.info("[%s] %s 找到srcprob文件: %s\n  可用列名: %s",
+                        thread_id, grb_name, srcprob_file, available_columns)
             
             # 查找GRB对应的概率列
             prob_col = grb_name
@@ -145,61 +221,69 @@ def find_highest_prob_photon(gta, grb_name, grb_params, results_dir=None, prob_t
                     logger.warning(f"[{thread_id}] {grb_name} 未找到对应的概率列")
                     return None
             
+            # 需要的列一次性转换为本机字节序数组，之后的读取不再重复字节交换
+            cols = {name: _native_column(events[name])
+                    for name in ('ENERGY', 'TIME', 'RA', 'DEC', prob_col)}
+            
             # 保存所有光子信息
             try:
-                all_photons_result = save_all_photons(events, prob_col, grb_name, grb_params, output_dir)
+                all_photons_result = save_all_photons(cols, prob_col, grb_name, grb_params, output_dir,
+                                                      summary_file=photons_summary_file,
+                                                      min_prob=photons_min_prob)
                 if all_photons_result:
                     logger.info(f"[{thread_id}] {grb_name} 所有光子信息保存成功: {all_photons_result}")
                 else:
                     logger.warning(f"[{thread_id}] {grb_name} 所有光子信息保存失败")
             except Exception as save_error:
-                logger.error(f"[{thread_id}] {grb_name} 保存所有光子信息时出现异常: {str(save_error)}")
-                import traceback
-                traceback.print_exc()
+                logger.exception("[%s] %s 保存所有光子信息时出现异常: %s", thread_id, grb_name, save_error)
             
             # 获取概率数据
-            prob = events[prob_col]
+            prob = cols[prob_col]
             
             # 筛选概率大于阈值的高可信光子
             high_prob_mask = prob > prob_threshold
-            high_prob_events = events[high_prob_mask]
-            high_prob_probs = prob[high_prob_mask]
+            total_high_prob_photons = int(np.count_nonzero(high_prob_mask))
             
-            logger.info(f"[{thread_id}] {grb_name} 共找到 {len(high_prob_events)} 个光子概率>{prob_threshold}")
+            logger.info(f"[{thread_id}] {grb_name} 共找到 {total_high_prob_photons} 个光子概率>{prob_threshold}")
             
-            if len(high_prob_events) == 0:
+            if total_high_prob_photons == 0:
                 logger.warning(f"[{thread_id}] {grb_name} 未找到概率>{prob_threshold}的光子")
                 return None
             
-            # 在高概率光子中找到最高能量的光子
-            max_energy_idx = np.argmax(high_prob_events['ENERGY'])
-            highest_photon = high_prob_events[max_energy_idx]
-            highest_prob = high_prob_probs[max_energy_idx]
+            # 在高概率光子中找到最高能量的光子：不满足条件的光子能量记为-inf后直接argmax，
+            # 不复制筛选后的事件数组
+            energies = cols['ENERGY']
+            max_energy_idx = int(np.argmax(np.where(high_prob_mask, energies, -np.inf)))
+            highest_prob = prob[max_energy_idx]
             
-            # 确保最高能量光子的概率大于0.9
+            # 确保最高能量光子的概率不小于0.9
             if highest_prob < 0.9:
                 logger.warning(f"[{thread_id}] {grb_name} 最高能光子概率 {highest_prob:.4f} 小于0.9，寻找替代光子")
-                # 筛选概率大于0.9的光子
                 very_high_prob_mask = prob > 0.9
-                very_high_prob_events = events[very_high_prob_mask]
-                very_high_prob_probs = prob[very_high_prob_mask]
-                
-                if len(very_high_prob_events) == 0:
+                if not very_high_prob_mask.any():
                     logger.warning(f"[{thread_id}] {grb_name} 未找到概率>0.9的光子")
                     return None
                 
                 # 在概率大于0.9的光子中找到最高能量的光子
-                max_energy_idx = np.argmax(very_high_prob_events['ENERGY'])
-                highest_photon = very_high_prob_events[max_energy_idx]
-                highest_prob = very_high_prob_probs[max_energy_idx]
+                max_energy_idx = int(np.argmax(np.where(very_high_prob_mask, energies, -np.inf)))
+                highest_prob = prob[max_energy_idx]
+            
+            highest_photon = events[max_energy_idx]
+            photon_energy = float(cols['ENERGY'][max_energy_idx])
+            photon_time = float(cols['TIME'][max_energy_idx])
+            photon_ra = float(cols['RA'][max_energy_idx])
+            photon_dec = float(cols['DEC'][max_energy_idx])
             
             # 计算相对于触发时间的时间
-            relative_time = float(highest_photon['TIME']) - grb_params['trigger_met']
+            relative_time = photon_time - grb_params['trigger_met']
             
             # 计算与GRB位置的角距离
-            grb_coord = SkyCoord(ra=grb_params['ra']*u.deg, dec=grb_params['dec']*u.deg)
-            photon_coord = SkyCoord(ra=highest_photon['RA']*u.deg, dec=highest_photon['DEC']*u.deg)
-            angular_separation = grb_coord.separation(photon_coord).degree
+            # 两个标量之间直接用haversine公式，无需构造SkyCoord
+            ra1, dec1 = math.radians(grb_params['ra']), math.radians(grb_params['dec'])
+            ra2, dec2 = math.radians(photon_ra), math.radians(photon_dec)
+            hav = (math.sin((dec2 - dec1) / 2) ** 2
+                   + math.cos(dec1) * math.cos(dec2) * math.sin((ra2 - ra1) / 2) ** 2)
+            angular_separation = math.degrees(2 * math.asin(min(1.0, math.sqrt(hav))))
             
             # 安全地获取事件类型信息
             event_class = -1
@@ -213,36 +297,35 @@ def find_highest_prob_photon(gta, grb_name, grb_params, results_dir=None, prob_t
                 pass
             
             result = {
-                'energy': float(highest_photon['ENERGY']),      # MeV
-                'time': float(highest_photon['TIME']),          # MET
+                'energy': photon_energy,                        # MeV
+                'time': photon_time,                            # MET
                 'relative_time': relative_time,                 # 相对触发时间 (s)
-                'ra': float(highest_photon['RA']),              # degrees
-                'dec': float(highest_photon['DEC']),            # degrees
+                'ra': photon_ra,                                # degrees
+                'dec': photon_dec,                              # degrees
                 'angular_separation': float(angular_separation), # degrees
                 'probability': float(highest_prob),             # 源概率
-                'total_high_prob_photons': len(high_prob_events), # 高概率光子总数
+                'total_high_prob_photons': total_high_prob_photons, # 高概率光子总数
                 'event_class': event_class,
                 'event_type': event_type
             }
             
-            logger.info(f"[{thread_id}] {grb_name} 最高能高概率光子:")
-            logger.info(f"[{thread_id}] {grb_name}   能量: {result['energy']:.2f} MeV")
-            logger.info(f"[{thread_id}] {grb_name}   概率: {result['probability']:.4f}")
-            logger.info(f"[{thread_id}] {grb_name}   角距离: {result['angular_separation']:.4f}°")
-            logger.info(f"[{thread_id}] {grb_name}   相对时间: {result['relative_time']:.2f} s")
+            logger.info("[%s] %s 最高能高概率光子:\n  能量: %.2f MeV\n  概率: %.4f\n  角距离: %.4f°\n  相对时间: %.2f s",
+                        thread_id, grb_name, result['energy'], result['probability'],
+                        result['angular_separation'], result['relative_time'])
             
-            # 创建高概率光子的DataFrame用于详细分析
-            df = pd.DataFrame({
-                'ENERGY': high_prob_events['ENERGY'],
-                'TIME': high_prob_events['TIME'],
-                'RELATIVE_TIME': high_prob_events['TIME'] - grb_params['trigger_met'],  # 添加相对时间
-                'PROB': high_prob_probs,
-                'RA': high_prob_events['RA'],
-                'DEC': high_prob_events['DEC']
-            })
-            
-            # 保存高概率光子信息
+            # 保存高概率光子信息（不保存时无需构建DataFrame）
             if results_dir:
+                # 创建高概率光子的DataFrame用于详细分析（只对需要的列做掩码，不复制整条事件记录）
+                high_prob_time = cols['TIME'][high_prob_mask]
+                df = pd.DataFrame({
+                    'ENERGY': cols['ENERGY'][high_prob_mask],
+                    'TIME': high_prob_time,
+                    'RELATIVE_TIME': high_prob_time - grb_params['trigger_met'],  # 添加相对时间
+                    'PROB': prob[high_prob_mask],
+                    'RA': cols['RA'][high_prob_mask],
+                    'DEC': cols['DEC'][high_prob_mask]
+                }, copy=False)
+                
                 os.makedirs(output_dir, exist_ok=True)
                 high_prob_file = os.path.join(output_dir, f"{grb_name}_high_prob_photons.csv")
                 df.to_csv(high_prob_file, index=False)
@@ -252,9 +335,7 @@ def find_highest_prob_photon(gta, grb_name, grb_params, results_dir=None, prob_t
             
     except Exception as e:
         thread_id = threading.current_thread().name
-        logger.error(f"[{thread_id}] {grb_name} 使用srcprob方法获取最高能光子信息失败: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("[%s] %s 使用srcprob方法获取最高能光子信息失败: %s", thread_id, grb_name, e)
         return None
 
 def analyze_high_prob_photons(gta, grb_name, grb_params, results_dir=None, prob_threshold=0.9, save_details=True):
@@ -289,7 +370,7 @@ def analyze_high_prob_photons(gta, grb_name, grb_params, results_dir=None, prob_
         return stats
         
     except Exception as e:
-        logger.error(f"分析高概率光子统计信息失败: {str(e)}")
+        logger.exception("分析高概率光子统计信息失败: %s", e)
         return None
 
 if __name__ == "__main__":
@@ -1,7 +1,7 @@
 import matplotlib.pyplot as plt
 import numpy as np
 
-def plot_sed(c, sed, source_name='GRB250320B', show_plot=True, figsize=(10, 8)):
+def plot_sed(c, sed, source_name='GRB250320B', show_plot=True, figsize=(10, 8), ax=None):
     """
     绘制SED图像
     
@@ -10,7 +10,8 @@ def plot_sed(c, sed, source_name='GRB250320B', show_plot=True, figsize=(10, 8)):
     sed: SED数据
     source_name: 源名称
     show_plot: 是否显示图像
-    figsize: 图像尺寸，默认(10, 8)
+    figsize: 图像尺寸，默认(10, 8)，仅在未提供ax时用于新建图像
+    ax: 绘图使用的Axes，默认为None时新建一个图像
     
     返回:
     None
@@ -25,35 +26,38 @@ def plot_sed(c, sed, source_name='GRB250320B', show_plot=True, figsize=(10, 8)):
     index = c['sources'][source_name]['spectral_pars']['Index']['value']
     index_err = c['sources'][source_name]['spectral_pars']['Index']['error']
     
-    # 清除之前的图像并设置画布大小
-    plt.figure(figsize=figsize)
-    plt.clf()
+    # 未提供Axes时按指定尺寸新建图像
+    if ax is None:
+        ax = plt.figure(figsize=figsize).gca()
     
     # 绘制理论曲线
-    plt.loglog(E, (E**2)*dnde, 'k--')
-    plt.loglog(E, (E**2)*dnde_hi, 'k', alpha=0.5)
-    plt.loglog(E, (E**2)*dnde_lo, 'k', alpha=0.5)
+    ax.loglog(E, (E**2)*dnde, 'k--')
+    ax.loglog(E, (E**2)*dnde_hi, 'k', alpha=0.5)
+    ax.loglog(E, (E**2)*dnde_lo, 'k', alpha=0.5)
     
     # 识别上限点 (dnde_err_lo为NaN的点)
+    # 上限点直接取e2dnde_ul95，不修改调用方传入的sed
     mask_ul = np.isnan(sed['dnde_err_lo'])
-    sed['e2dnde'] = np.where(mask_ul, sed['e2dnde_ul95'], sed['e2dnde'])
     
     # 分离检测点和上限点
     detected = ~mask_ul  # 检测到的点
     upper_limits = mask_ul  # 上限点
     
+    # 各类点的数值只索引一次，绘图和计算y轴上限共用
+    detected_e2 = sed['e2dnde'][detected]
+    detected_err = sed['e2dnde_err'][detected]
+    ul_e2 = sed['e2dnde_ul95'][upper_limits]
+    
     # 计算x轴误差
-    xerr = np.array([
-        sed['e_ctr'] - sed['e_min'],  # 左误差
-        sed['e_max'] - sed['e_ctr']   # 右误差
-    ])
+    xerr_lo = sed['e_ctr'] - sed['e_min']  # 左误差
+    xerr_hi = sed['e_max'] - sed['e_ctr']  # 右误差
     
     # 绘制检测点（带双侧误差棒和T型帽）
     if np.any(detected):
-        plt.errorbar(sed['e_ctr'][detected], 
-                     sed['e2dnde'][detected], 
-                     yerr=sed['e2dnde_err'][detected], 
-                     xerr=xerr[:, detected],
+        ax.errorbar(sed['e_ctr'][detected], 
+                     detected_e2, 
+                     yerr=detected_err, 
+                     xerr=[xerr_lo[detected], xerr_hi[detected]],
                      fmt='o', 
                      color='black', 
                      capsize=3,  # 添加T型帽，capsize控制帽的长度
@@ -62,10 +66,10 @@ def plot_sed(c, sed, source_name='GRB250320B', show_plot=True, figsize=(10, 8)):
     
     # 绘制上限点（带向上箭头）
     if np.any(upper_limits):
-        plt.errorbar(sed['e_ctr'][upper_limits], 
-                     sed['e2dnde'][upper_limits], 
-                     xerr=xerr[:, upper_limits],
-                     yerr=0.3 * sed['e2dnde'][upper_limits],  # 小偏移使箭头可见
+        ax.errorbar(sed['e_ctr'][upper_limits], 
+                     ul_e2, 
+                     xerr=[xerr_lo[upper_limits], xerr_hi[upper_limits]],
+                     yerr=0.3 * ul_e2,  # 小偏移使箭头可见
                      uplims=True,  # 显示为上限
                      fmt='none',   # 不显示数据点标记
                      color='black',
@@ -74,32 +78,12 @@ def plot_sed(c, sed, source_name='GRB250320B', show_plot=True, figsize=(10, 8)):
                      )
     
     # 添加谱指数信息
-    plt.gca().text(0.98, 0.98, f"Index: {index:.2f} ± {index_err:.2f}", 
-                   transform=plt.gca().transAxes, 
-                   ha='right', 
-                   va='top', 
-                   fontsize=10, 
-                   bbox=dict(facecolor='white', alpha=0.7, edgecolor='none'))
-    
-    # 动态计算y轴上限
-    # 考虑所有数据点：检测点+误差、上限点
-    max_values = []
-    
-    # 检测点的最大值（数据点+误差）
-    if np.any(detected):
-        detected_max = np.nanmax(sed['e2dnde'][detected] + sed['e2dnde_err'][detected])
-        max_values.append(detected_max)
-    
-    # 上限点的最大值
-    if np.any(upper_limits):
-        ul_max = np.nanmax(sed['e2dnde_ul95'][upper_limits])
-        max_values.append(ul_max)
-    
-    # 设置y轴上限为最大值的1.5倍，确保所有数据都可见
-    if max_values:
-        y_max = max(max_values) * 1.5
-    else:
-        y_max = 1e-2  # 默认值
+    ax.text(0.98, 0.98, f"Index: {index:.2f} ± {index_err:.2f}", 
+            transform=ax.transAxes, 
+            ha='right', 
+            va='top', 
+            fontsize=10, 
+            bbox=dict(facecolor='white', alpha=0.7, edgecolor='none'))
     
     # 动态计算y轴上限
     # 考虑所有数据点：检测点+误差、上限点
@@ -107,12 +91,12 @@ def plot_sed(c, sed, source_name='GRB250320B', show_plot=True, figsize=(10, 8)):
     
     # 检测点的最大值（数据点+误差）
     if np.any(detected):
-        detected_max = np.nanmax(sed['e2dnde'][detected] + sed['e2dnde_err'][detected])
+        detected_max = np.nanmax(detected_e2 + detected_err)
         max_values.append(detected_max)
     
     # 上限点的最大值
     if np.any(upper_limits):
-        ul_max = np.nanmax(sed['e2dnde_ul95'][upper_limits])
+        ul_max = np.nanmax(ul_e2)
         max_values.append(ul_max)
     
     # 设置y轴上限为最大值的1.5倍，确保所有数据都可见
@@ -122,11 +106,11 @@ def plot_sed(c, sed, source_name='GRB250320B', show_plot=True, figsize=(10, 8)):
         y_max = 1e-2  # 默认值
     
     # 设置坐标轴
-    plt.xlim(1e2, 1e5)
-    plt.ylim(bottom=1e-5, top=y_max)
-    plt.xlabel('E [MeV]')
-    plt.ylabel(r'E$^{2}$ dN/dE [MeV cm$^{-2}$ s$^{-1}$]')
-    plt.legend()  # 显示图例区分点类型
+    ax.set_xlim(1e2, 1e5)
+    ax.set_ylim(bottom=1e-5, top=y_max)
+    ax.set_xlabel('E [MeV]')
+    ax.set_ylabel(r'E$^{2}$ dN/dE [MeV cm$^{-2}$ s$^{-1}$]')
+    ax.legend()  # 显示图例区分点类型
     
     if show_plot:
         plt.show()
@@ -145,13 +129,16 @@ def save_sed_plot(c, sed, source_name='GRB250320B', filename=None, figsize=(10,
     返回:
     保存的文件路径
     """
-    plt.figure(figsize=figsize)
-    plot_sed(c, sed, source_name, show_plot=False)
-    
-    if filename is None:
-        filename = f"{source_name.lower()}_sed.png"
-    
-    plt.savefig(filename, dpi=300, bbox_inches='tight')
-    plt.close()
+    # 只创建一个图像，保存后立即关闭，批量绘图时不会累积未释放的图像
+    fig, ax = plt.subplots(figsize=figsize)
+    try:
+        plot_sed(c, sed, source_name, show_plot=False, ax=ax)
+        
+        if filename is None:
+            filename = f"{source_name.lower()}_sed.png"
+        
+        fig.savefig(filename, dpi=300, bbox_inches='tight')
+    finally:
+        plt.close(fig)
     
     return filename
\ No newline at end of file
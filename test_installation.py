@@ -9,52 +9,135 @@ Fermi LAT Program 安装测试脚本
 
 import sys
 import os
+import io
 import subprocess
 import importlib
+import importlib.util
+import threading
+import concurrent.futures
+from datetime import datetime
 from pathlib import Path
 
+try:
+    from importlib.metadata import version as distribution_version, PackageNotFoundError
+except ImportError:  # Python 3.7没有importlib.metadata，只能导入模块读取__version__
+    distribution_version = None
+    PackageNotFoundError = None
+
+# Python版本要求，模块加载时检查一次
+REQUIRED_PYTHON = (3, 7)
+_PY_OK = sys.version_info >= REQUIRED_PYTHON
+
+# 导入名与发行包名不同的依赖
+_DISTRIBUTION_NAMES = {
+    'yaml': 'PyYAML',
+}
+
+# 各测试阶段并行运行时，每个线程的输出先写入自己的缓冲区，结束后按固定顺序打印
+_output = threading.local()
+
+def output(*args, **kwargs):
+    """打印到当前测试阶段的输出缓冲区（不在测试阶段内时直接打印到标准输出）"""
+    print(*args, file=getattr(_output, 'buffer', None) or sys.stdout, **kwargs)
+
 def print_header(title):
     """打印测试标题"""
-    print(f"\n{'='*50}")
-    print(f" {title}")
-    print(f"{'='*50}")
+    rule = '='*50
+    output(f"\n{rule}\n {title}\n{rule}")
 
 def print_result(test_name, success, message=""):
-    """打印测试结果"""
+    """打印测试结果（结果行和详情一次写出）"""
     status = "✅ 通过" if success else "❌ 失败"
-    print(f"{test_name:<30} {status}")
     if message:
-        print(f"   详情: {message}")
+        output(f"{test_name:<30} {status}\n   详情: {message}")
+    else:
+        output(f"{test_name:<30} {status}")
+
+_sys_modules = sys.modules
+
+# cached_import已完整导入的模块
+_imported = {}
+
+def cached_import(module_name):
+    """
+    导入模块，本脚本已导入过的模块直接返回，不再经过导入机制
+    
+    只缓存importlib.import_module已返回的模块；其他线程仍在初始化的模块
+    由import_module通过模块导入锁等待其初始化完成，不会拿到未初始化完的模块。
+    """
+    module = _imported.get(module_name)
+    if module is None:
+        module = importlib.import_module(module_name)
+        _imported[module_name] = module
+    return module
+
+# 已确认无法导入的模块，再次检查时直接返回，不再重新搜索sys.path
+_missing = set()
+
+def module_available(module_name):
+    """只查找模块是否已安装，不执行模块代码（结果缓存）"""
+    if module_name in _missing:
+        return False
+    if module_name in _sys_modules:
+        return True
+    try:
+        available = importlib.util.find_spec(module_name) is not None
+    except (ImportError, ValueError):
+        available = False
+    if not available:
+        _missing.add(module_name)
+    return available
+
+def run_phase(name, test_func):
+    """
+    在当前线程运行一个测试阶段，返回(测试结果, 该阶段的全部输出)
+    
+    测试阶段抛出未处理的异常时记为失败，不影响其他阶段和结果汇总。
+    """
+    _output.buffer = io.StringIO()
+    try:
+        try:
+            result = test_func()
+        except Exception as e:
+            print_result(name, False, f"测试过程出现异常: {type(e).__name__}: {e}")
+            result = False
+        return result, _output.buffer.getvalue()
+    finally:
+        del _output.buffer
+
+def import_package():
+    """导入fermilatprogram包，失败时返回None（错误由需要该包的测试阶段自行导入并报告）"""
+    try:
+        return cached_import('fermilatprogram')
+    except Exception:
+        return None
 
 def test_python_version():
     """测试Python版本"""
     print_header("Python环境检查")
     
     version = sys.version_info
-    print(f"Python版本: {version.major}.{version.minor}.{version.micro}")
+    output(f"Python版本: {version.major}.{version.minor}.{version.micro}")
     
-    # 检查Python版本是否满足要求
-    required_version = (3, 7)
-    version_ok = version >= required_version
-    print_result("Python版本检查", version_ok, 
-                f"需要 >= {required_version[0]}.{required_version[1]}, 当前: {version.major}.{version.minor}")
+    # Python版本是否满足要求已在模块加载时检查
+    print_result("Python版本检查", _PY_OK, 
+                f"需要 >= {REQUIRED_PYTHON[0]}.{REQUIRED_PYTHON[1]}, 当前: {version.major}.{version.minor}")
     
-    return version_ok
+    return _PY_OK
 
-def test_package_import():
-    """测试包导入"""
+def test_package_import(pkg=None):
+    """测试包导入（pkg为已导入的fermilatprogram包，为None时在此导入）"""
     print_header("包导入测试")
     
-    results = []
+    all_passed = True
     
     # 测试主包导入
     try:
-        import fermilatprogram
-        print_result("主包导入", True, f"版本: {fermilatprogram.__version__}")
-        results.append(True)
-    except ImportError as e:
+        if pkg is None:
+            pkg = cached_import('fermilatprogram')
+        print_result("主包导入", True, f"版本: {pkg.__version__}")
+    except Exception as e:
         print_result("主包导入", False, str(e))
-        results.append(False)
         return False  # 主包导入失败，后续测试无意义
     
     # 测试子模块导入
@@ -68,14 +151,43 @@ def test_package_import():
     
     for module_name, description in modules:
         try:
-            module = importlib.import_module(f'fermilatprogram.{module_name}')
+            module = cached_import(f'fermilatprogram.{module_name}')
             print_result(f"{module_name}模块导入", True, description)
-            results.append(True)
         except ImportError as e:
             print_result(f"{module_name}模块导入", False, str(e))
-            results.append(False)
+            all_passed = False
     
-    return all(results)
+    return all_passed
+
+def installed_version(module_name):
+    """从已安装发行包的元数据读取版本号，不导入模块；无法读取时返回None"""
+    if distribution_version is None:
+        return None
+    try:
+        return distribution_version(_DISTRIBUTION_NAMES.get(module_name, module_name))
+    except PackageNotFoundError:
+        return None
+
+def _try_import(module_name, description):
+    """
+    检查一个依赖包是否已安装并能正常导入
+    
+    返回(包名, 描述, 是否成功, 详情)：成功时详情为版本号；未安装时为None；
+    已安装但导入失败（如二进制不兼容、缺少共享库）时为错误信息。
+    """
+    if not module_available(module_name):
+        return module_name, description, False, None
+    
+    # 已安装的包仍须实际导入一次，确认能正常加载
+    try:
+        module = cached_import(module_name)
+    except Exception as e:
+        _missing.add(module_name)
+        return module_name, description, False, f"{type(e).__name__}: {e}"
+    
+    # 版本号优先从元数据读取，读取不到时使用模块的__version__
+    version = installed_version(module_name) or getattr(module, '__version__', '未知版本')
+    return module_name, description, True, version
 
 def test_dependencies():
     """测试依赖包"""
@@ -90,28 +202,34 @@ def test_dependencies():
         ('yaml', 'PyYAML配置文件库'),
         ('h5py', 'HDF5文件处理库')
     ]
+    # 特殊检查fermipy（可能不是必需的）
+    optional_dependency = ('fermipy', 'FermiPy分析库')
     
-    results = []
+    # 各依赖包并行导入，读取文件和加载扩展模块的时间相互重叠；结果按列表顺序输出
+    all_dependencies = dependencies + [optional_dependency]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(8, len(all_dependencies))) as executor:
+        import_results = list(executor.map(lambda dep: _try_import(*dep), all_dependencies))
     
-    for dep_name, description in dependencies:
-        try:
-            module = importlib.import_module(dep_name)
-            version = getattr(module, '__version__', '未知版本')
-            print_result(f"{dep_name}依赖", True, f"{description} (v{version})")
-            results.append(True)
-        except ImportError:
+    all_passed = True
+    
+    for dep_name, description, ok, detail in import_results[:-1]:
+        if ok:
+            print_result(f"{dep_name}依赖", True, f"{description} (v{detail})")
+        elif detail:
+            print_result(f"{dep_name}依赖", False, f"{description} - 导入失败: {detail}")
+        else:
             print_result(f"{dep_name}依赖", False, f"{description} - 未安装")
-            results.append(False)
+        all_passed &= ok
     
-    # 特殊检查fermipy（可能不是必需的）
-    try:
-        import fermipy
-        version = getattr(fermipy, '__version__', '未知版本')
-        print_result("fermipy依赖", True, f"FermiPy分析库 (v{version})")
-    except ImportError:
-        print_result("fermipy依赖", False, "FermiPy分析库 - 未安装（可选）")
+    dep_name, description, ok, detail = import_results[-1]
+    if ok:
+        print_result(f"{dep_name}依赖", True, f"{description} (v{detail})")
+    elif detail:
+        print_result(f"{dep_name}依赖", False, f"{description} - 导入失败（可选）: {detail}")
+    else:
+        print_result(f"{dep_name}依赖", False, f"{description} - 未安装（可选）")
     
-    return all(results)
+    return all_passed
 
 def test_command_line_tools():
     """测试命令行工具"""
@@ -123,34 +241,48 @@ def test_command_line_tools():
         ('grb-config', '配置文件生成工具')
     ]
     
-    results = []
+    all_passed = True
     
+    # 先同时启动所有 --help 命令，再依次等待，总耗时约等于最慢的一个命令；
+    # 输出直接丢弃，只看退出码
+    procs = []
     for tool_name, description in tools:
         try:
-            # 尝试运行 --help 命令
-            result = subprocess.run([tool_name, '--help'], 
-                                  capture_output=True, 
-                                  text=True, 
-                                  timeout=10)
-            
-            if result.returncode == 0:
-                print_result(f"{tool_name}命令", True, description)
-                results.append(True)
-            else:
-                print_result(f"{tool_name}命令", False, f"退出码: {result.returncode}")
-                results.append(False)
-                
-        except (subprocess.TimeoutExpired, FileNotFoundError) as e:
+            proc = subprocess.Popen([tool_name, '--help'],
+                                    stdout=subprocess.DEVNULL,
+                                    stderr=subprocess.DEVNULL)
+        except FileNotFoundError as e:
+            proc = e
+        procs.append((tool_name, description, proc))
+    
+    for tool_name, description, proc in procs:
+        if isinstance(proc, FileNotFoundError):
+            print_result(f"{tool_name}命令", False, f"命令不可用: {str(proc)}")
+            all_passed = False
+            continue
+        
+        try:
+            returncode = proc.wait(timeout=10)
+        except subprocess.TimeoutExpired as e:
+            proc.kill()
+            proc.wait()
             print_result(f"{tool_name}命令", False, f"命令不可用: {str(e)}")
-            results.append(False)
+            all_passed = False
+            continue
+        
+        if returncode == 0:
+            print_result(f"{tool_name}命令", True, description)
+        else:
+            print_result(f"{tool_name}命令", False, f"退出码: {returncode}")
+            all_passed = False
     
-    return all(results)
+    return all_passed
 
 def test_basic_functionality():
     """测试基本功能"""
     print_header("基本功能测试")
     
-    results = []
+    all_passed = True
     
     try:
         from fermilatprogram import lkmulty
@@ -160,38 +292,37 @@ def test_basic_functionality():
             grb_list = lkmulty.get_grb_list()
             if isinstance(grb_list, list):
                 print_result("GRB列表获取", True, f"找到 {len(grb_list)} 个GRB事件")
-                results.append(True)
             else:
                 print_result("GRB列表获取", False, "返回值不是列表类型")
-                results.append(False)
+                all_passed = False
         except Exception as e:
             print_result("GRB列表获取", False, str(e))
-            results.append(False)
+            all_passed = False
         
         # 测试配置解析功能
         try:
             from fermilatprogram.Generate_gconfig import parse_grb_info
             print_result("配置解析功能", True, "parse_grb_info函数可用")
-            results.append(True)
         except Exception as e:
             print_result("配置解析功能", False, str(e))
-            results.append(False)
+            all_passed = False
             
     except ImportError as e:
         print_result("基本功能测试", False, f"模块导入失败: {str(e)}")
-        results.append(False)
+        all_passed = False
     
-    return all(results)
+    return all_passed
 
-def test_file_structure():
-    """测试文件结构"""
+def test_file_structure(pkg=None):
+    """测试文件结构（pkg为已导入的fermilatprogram包，为None时在此导入）"""
     print_header("文件结构检查")
     
     # 获取包的安装路径
     try:
-        import fermilatprogram
-        package_path = Path(fermilatprogram.__file__).parent
-        print(f"包安装路径: {package_path}")
+        if pkg is None:
+            pkg = cached_import('fermilatprogram')
+        package_path = Path(pkg.__file__).parent
+        output(f"包安装路径: {package_path}")
         
         # 检查关键文件
         key_files = [
@@ -203,14 +334,17 @@ def test_file_structure():
             'cleandir.py'
         ]
         
-        results = []
+        # 一次列出包目录的全部条目，再逐个检查文件名是否在其中，无需对每个文件单独stat
+        with os.scandir(package_path) as entries:
+            present = {entry.name for entry in entries}
+        
+        all_passed = True
         for filename in key_files:
-            file_path = package_path / filename
-            exists = file_path.exists()
-            print_result(f"{filename}文件", exists, f"路径: {file_path}")
-            results.append(exists)
+            exists = filename in present
+            print_result(f"{filename}文件", exists, f"路径: {package_path / filename}")
+            all_passed &= exists
         
-        return all(results)
+        return all_passed
         
     except Exception as e:
         print_result("文件结构检查", False, str(e))
@@ -219,17 +353,33 @@ def test_file_structure():
 def main():
     """主测试函数"""
     print("🧪 Fermi LAT Program 安装测试")
-    print(f"测试时间: {os.popen('date').read().strip()}")
-    
-    # 运行所有测试
-    test_results = {
-        "Python环境": test_python_version(),
-        "包导入": test_package_import(),
-        "依赖包": test_dependencies(),
-        "命令行工具": test_command_line_tools(),
-        "基本功能": test_basic_functionality(),
-        "文件结构": test_file_structure()
-    }
+    print(f"测试时间: {datetime.now():%a %b %d %H:%M:%S %Y}")
+    
+    # 各测试阶段互不依赖，并行运行（命令行工具的子进程等待与模块导入相互重叠），
+    # 输出按下面的顺序依次打印
+    test_results = {}
+    # 6个测试阶段加上主包导入，各占一个线程：主包导入也在线程池中运行，与其他阶段重叠
+    with concurrent.futures.ThreadPoolExecutor(max_workers=7) as executor:
+        # 主包只导入一次，需要它的测试阶段等待导入完成后直接使用
+        package_future = executor.submit(import_package)
+        
+        def with_package(test_func):
+            return lambda: test_func(package_future.result())
+        
+        phases = {
+            "Python环境": test_python_version,
+            "包导入": with_package(test_package_import),
+            "依赖包": test_dependencies,
+            "命令行工具": test_command_line_tools,
+            "基本功能": test_basic_functionality,
+            "文件结构": with_package(test_file_structure)
+        }
+        
+        futures = {name: executor.submit(run_phase, name, test_func) for name, test_func in phases.items()}
+        for name, future in futures.items():
+            result, phase_output = future.result()
+            sys.stdout.write(phase_output)
+            test_results[name] = result
     
     # 汇总结果
     print_header("测试结果汇总")